@@ -0,0 +1,302 @@
+"""
+    In-memory call graph built from the `cflow` output, and rendered in the `cflow` direct tree, reverse tree
+    and cross-reference formats, so the CFlowTree() builder can run `cflow` once for the call trees.
+
+    The calls are read from the direct tree for all functions, printed with the nesting level of each line:
+        cflow --all --all --brief --print-level whoami.c
+    where each function is listed with its callees, one level deeper:
+        {   0} main() <int main (int argc,char **argv) at whoami.c:26>:
+        {   1}     printf()
+    so the calls are the ones `cflow` finds in the function bodies, without the references from file-scope
+    initializers.
+
+    The `--xref` output lists the definition of each function, with the declaration and the location:
+        main * whoami.c:26 int (int argc,char **argv)
+    followed by each reference to the symbol:
+        printf   whoami.c:32
+    and is only used to write the cross-reference again, after merging the outputs for several sources.
+
+    Usage:
+        graph = CallGraph()
+        graph.add_tree(open('program.calls.cflow'))
+        graph.write_tree(sys.stdout, graph.global_functions())
+        graph.write_reverse_tree(sys.stdout)
+        graph.write_binary('program.cgraph')
+
+    The binary call graph is read by the call_graph_reader.py module, see there for the file layout.
+"""
+
+import re
+import struct
+
+""" file signature and format version for the binary call graph """
+BINARY_MAGIC   = b'XRCGRAPH'
+BINARY_VERSION = 1
+
+""" index value for a function without a known definition """
+NO_FILE = 0xFFFFFFFF
+
+def encode(text):
+    """ translate a native str to UTF-8 bytes, keeping any bytes that were not valid UTF-8 in the input """
+    return text if isinstance(text, bytes) else text.encode('utf-8', 'surrogateescape')
+
+""" line of the `cflow --print-level` tree, with the nesting level and the text, after any line number """
+TREE_LINE = re.compile(r'^\s*(?:\d+\s+)?\{\s*(\d+)\}\s*(\S.*)$')
+
+""" declaration and location of a function defined in the sources, in the `cflow` tree """
+TREE_DEFINITION = re.compile(r'<(.*) at (.+):(\d+)>')
+
+class CallGraph:
+    """ Function definitions with their calls, read from one or more `cflow` outputs """
+    def __init__(self):
+        self.definitions = { }      # name: (declaration, file, line)
+        self.calls       = { }      # name: [ called functions, in the order listed by `cflow` ]
+        self.callers     = None
+        self.xref        = { }      # name: (declaration, file, line) from the cross-reference
+        self.references  = { }      # file: set of (line, name)
+
+    def add_tree(self, lines):
+        """ add the definitions and calls from the lines of a `cflow --all --all --brief --print-level` output """
+        parents = [ ]
+
+        for line in lines:
+            match = TREE_LINE.match(line.rstrip('\r\n'))
+
+            if not match:
+                continue
+
+            level, text = int(match.group(1)), match.group(2)
+            name        = text.split('(', 1)[0].strip()
+            definition  = TREE_DEFINITION.search(text)
+
+            if definition and name not in self.definitions:
+                self.definitions[name] = (definition.group(1), definition.group(2), int(definition.group(3)))
+
+            del parents[level:]
+
+            if level and len(parents) == level:
+                calls = self.calls.setdefault(parents[-1], [ ])
+
+                if name not in calls:
+                    calls.append(name)
+
+            parents.append(name)
+
+        self.callers = None
+
+    def add_xref(self, lines):
+        """ add the definitions and references from the lines of a `cflow --xref` output, for write_xref() """
+        for line in lines:
+            fields = line.rstrip('\r\n').split(None, 3)
+
+            if len(fields) >= 3 and fields[1] == '*':
+                file_name, line_number = fields[2].rsplit(':', 1)
+
+                if fields[0] not in self.xref:
+                    self.xref[fields[0]] = (fields[3] if len(fields) > 3 else '', file_name, int(line_number))
+            elif len(fields) == 2 and ':' in fields[1]:
+                file_name, line_number = fields[1].rsplit(':', 1)
+
+                self.references.setdefault(file_name, set()).add((int(line_number), fields[0]))
+
+    def link(self):
+        """ build the callers lists from the calls """
+        if self.callers is not None:
+            return
+
+        self.callers = { }
+
+        for caller, calls in self.calls.items():
+            for name in calls:
+                self.callers.setdefault(name, [ ]).append(caller)
+
+        for callers in self.callers.values():
+            callers.sort()
+
+    def symbols(self):
+        """ return the sorted list of all functions, defined or only called """
+        self.link()
+
+        return sorted(set(self.definitions) | set(self.calls) | set(self.callers))
+
+    def global_functions(self, include_static = False):
+        """ return the sorted list of defined functions, without the static ones unless `include_static` is set """
+        return \
+            sorted\
+                (
+                    [
+                        name for name, (declaration, file_name, line) in self.definitions.items()
+                            if include_static or 'static' not in declaration.split()
+                    ]
+                )
+
+    def recursive_functions(self):
+        """ return the set of functions that can call themselves, directly or through other functions """
+        self.link()
+
+        recursive = set()
+        index     = { }
+        low_link  = { }
+        stack     = [ ]
+        on_stack  = set()
+        counter   = [ 0 ]
+
+        for root in self.symbols():
+            if root in index:
+                continue
+
+            # iterative Tarjan algorithm for strongly connected components
+            work = [ (root, 0) ]
+
+            while work:
+                name, child_index = work.pop()
+
+                if child_index == 0:
+                    index[name] = low_link[name] = counter[0]
+                    counter[0] += 1
+                    stack.append(name)
+                    on_stack.add(name)
+
+                calls = self.calls.get(name, [ ])
+
+                if child_index < len(calls):
+                    work.append((name, child_index + 1))
+                    callee = calls[child_index]
+
+                    if callee not in index:
+                        work.append((callee, 0))
+                    elif callee in on_stack:
+                        low_link[name] = min(low_link[name], index[callee])
+
+                    continue
+
+                if low_link[name] == index[name]:
+                    component = [ ]
+
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+
+                        if member == name:
+                            break
+
+                    if len(component) > 1 or name in calls:
+                        recursive.update(component)
+
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[name])
+
+        return recursive
+
+    def describe(self, name):
+        """ return the `name() <declaration at file:line>` text for a function, as in the `cflow` tree """
+        if name in self.definitions:
+            declaration, file_name, line = self.definitions[name]
+
+            return name + '() <' + declaration + ' at ' + file_name + ':' + str(line) + '>'
+
+        return name + '()'
+
+    def write_graph(self, output, roots, edges, indent = '    '):
+        """ write the tree for each root, following `edges`, with recursive calls marked as `cflow` does """
+        recursive = self.recursive_functions()
+        line_no   = [ 0 ]
+
+        def write_node(name, depth, active):
+            line_no[0] += 1
+            text = indent * depth + self.describe(name)
+
+            if name in active:
+                output.write(text + ' (recursive: see ' + str(active[name]) + ')\n')
+                return
+
+            children = edges.get(name, [ ])
+
+            output.write(text + (' (R)' if name in recursive else '') + (':' if children else '') + '\n')
+
+            active[name] = line_no[0]
+
+            for child in children:
+                write_node(child, depth + 1, active)
+
+            del active[name]
+
+        for root in roots:
+            write_node(root, 0, { })
+
+    def write_tree(self, output, roots):
+        """ write the direct call tree (default `cflow` output) starting from the given functions """
+        self.link()
+        self.write_graph(output, roots, self.calls)
+
+    def write_reverse_tree(self, output):
+        """ write the reverse call tree (`cflow --reverse` output) for all functions """
+        self.link()
+        self.write_graph(output, self.symbols(), self.callers)
+
+    def write_xref(self, output):
+        """ write the cross-reference (`cflow --xref` output) for all symbols """
+        references = { }
+
+        for file_name, file_references in self.references.items():
+            for line, name in file_references:
+                references.setdefault(name, [ ]).append((file_name, line))
+
+        for name in sorted(set(self.xref) | set(references)):
+            if name in self.xref:
+                declaration, file_name, line = self.xref[name]
+                output.write(name + ' * ' + file_name + ':' + str(line) + ' ' + declaration + '\n')
+
+            for file_name, line in sorted(references.get(name, [ ])):
+                output.write(name + '   ' + file_name + ':' + str(line) + '\n')
+
+    def write_binary(self, file_name):
+        """
+            Write the call graph in the compact binary format: an interned string table with the sorted
+            function names and the file names, the definition file and line for each function, and the
+            calls and callers lists as CSR arrays (offsets into a flat array of function indexes).
+        """
+        self.link()
+
+        names      = self.symbols()
+        name_index = dict([ (name, index) for index, name in enumerate(names) ])
+        files      = sorted(set([ definition[1] for definition in self.definitions.values() ]))
+        file_index = dict([ (name, index) for index, name in enumerate(files) ])
+
+        strings = [ encode(name) for name in names + files ]
+        offsets = [ 0 ]
+
+        for string in strings:
+            offsets.append(offsets[-1] + len(string))
+
+        blob = b''.join(strings)
+        blob += b'\0' * (-len(blob) % 4)
+
+        def csr(edges):
+            edge_offsets, targets = [ 0 ], [ ]
+
+            for name in names:
+                targets.extend([ name_index[target] for target in edges.get(name, [ ]) ])
+                edge_offsets.append(len(targets))
+
+            return edge_offsets, targets
+
+        calls_offsets,   calls   = csr(self.calls)
+        callers_offsets, callers = csr(self.callers)
+
+        def u32_array(values):
+            return struct.pack('<' + str(len(values)) + 'I', *values)
+
+        with open(file_name, 'wb') as output:
+            output.write(BINARY_MAGIC)
+            output.write(struct.pack('<5I', BINARY_VERSION, len(names), len(files), len(calls), len(blob)))
+            output.write(u32_array(offsets))
+            output.write(blob)
+            output.write(u32_array([ file_index[self.definitions[name][1]] if name in self.definitions else NO_FILE for name in names ]))
+            output.write(u32_array([ self.definitions[name][2] if name in self.definitions else 0 for name in names ]))
+            output.write(u32_array(calls_offsets))
+            output.write(u32_array(calls))
+            output.write(u32_array(callers_offsets))
+            output.write(u32_array(callers))
@@ -0,0 +1,241 @@
+"""
+    Read-only query API for the binary call graph generated by the CFlowTree() builder with $CFLOWGRAPH, for
+    use in scripts and review tools, without searching the indented text of the `.reverse.cflow` output.
+
+    The file is memory-mapped, and only the entries needed for each query are unpacked, so loading the file
+    and answering a query take about the same time for small and for large programs.
+
+    File layout, with all integers as unsigned 32-bit little-endian values:
+        magic           8 bytes, 'XRCGRAPH'
+        header          version, function count N, file count F, call count E, string table size S
+        string offsets  N + F + 1 offsets into the string table
+        string table    S bytes, UTF-8 function names in sorted order followed by the file names
+        files           N entries, index of the definition file for each function, or 0xFFFFFFFF
+        lines           N entries, line of the definition for each function
+        calls offsets   N + 1 offsets into the calls array
+        calls           E entries, index of the called function, for each call made by each function
+        callers offsets N + 1 offsets into the callers array
+        callers         E entries, index of the calling function, for each function
+
+    Usage:
+        with CallGraphReader('calltree.cgraph') as graph:
+            print(graph.callers('parse_args'))
+            print(graph.callees('main'))
+            print(graph.location('main'))
+            print(graph.closure('main'))                            # all functions reachable from main()
+            print(graph.closure('free_list', reverse = True))       # all functions that can reach free_list()
+            print(graph.paths('main', 'free_list', max_depth = 4))
+
+    The module can also be run as a script:
+        python call_graph_reader.py [--callees | --callers | --all-callees | --all-callers] calltree.cgraph function...
+        python call_graph_reader.py --paths calltree.cgraph caller callee [max_depth]
+"""
+
+import sys
+import os
+import mmap
+import struct
+
+from call_graph import BINARY_MAGIC, BINARY_VERSION, NO_FILE, encode
+
+def decode(data):
+    """ translate UTF-8 bytes from the call graph file to native str """
+    return data if str is bytes else data.decode('utf-8', 'surrogateescape')
+
+class CallGraphReader:
+    """ Memory-mapped binary call graph """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file      = open(file_name, 'rb')
+        self.data      = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        header_end = len(BINARY_MAGIC) + 5 * 4
+
+        if self.data.size() < header_end or self.data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            self.close()
+            raise ValueError(file_name + ': not a call graph file')
+
+        version, self.count, self.file_count, self.edge_count, string_size = struct.unpack_from('<5I', self.data, len(BINARY_MAGIC))
+
+        if version != BINARY_VERSION:
+            self.close()
+            raise ValueError(file_name + ': unsupported call graph version ' + str(version))
+
+        self.string_offsets  = header_end
+        self.strings         = self.string_offsets + 4 * (self.count + self.file_count + 1)
+        self.files           = self.strings + string_size
+        self.lines           = self.files + 4 * self.count
+        self.calls_offsets   = self.lines + 4 * self.count
+        self.calls_array     = self.calls_offsets + 4 * (self.count + 1)
+        self.callers_offsets = self.calls_array + 4 * self.edge_count
+        self.callers_array   = self.callers_offsets + 4 * (self.count + 1)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def u32(self, section, index):
+        return struct.unpack_from('<I', self.data, section + 4 * index)[0]
+
+    def u32_array(self, section, start, end):
+        return struct.unpack_from('<' + str(end - start) + 'I', self.data, section + 4 * start)
+
+    def string(self, index):
+        start, end = self.u32_array(self.string_offsets, index, index + 2)
+
+        return self.data[self.strings + start:self.strings + end]
+
+    def name(self, index):
+        """ return the function name for a function index """
+        return decode(self.string(index))
+
+    def index(self, name):
+        """ return the function index for a function name, or None if the function is not in the call graph """
+        key, low, high = encode(name), 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.string(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low if low < self.count and self.string(low) == key else None
+
+    def location(self, name):
+        """ return the (file, line) of the function definition, or None if not defined in the sources """
+        index = self.index(name)
+
+        if index is None or self.u32(self.files, index) == NO_FILE:
+            return None
+
+        return decode(self.string(self.count + self.u32(self.files, index))), self.u32(self.lines, index)
+
+    def neighbours(self, index, reverse):
+        offsets, edges = (self.callers_offsets, self.callers_array) if reverse else (self.calls_offsets, self.calls_array)
+
+        return self.u32_array(edges, *self.u32_array(offsets, index, index + 2))
+
+    def callees(self, name):
+        """ return the functions called by the given function, in the order of the calls in the source """
+        index = self.index(name)
+
+        return [ ] if index is None else [ self.name(callee) for callee in self.neighbours(index, False) ]
+
+    def callers(self, name):
+        """ return the functions calling the given function """
+        index = self.index(name)
+
+        return [ ] if index is None else [ self.name(caller) for caller in self.neighbours(index, True) ]
+
+    def closure(self, name, reverse = False, max_depth = None):
+        """
+            Return the sorted list of functions called by the given function, directly or indirectly, up to
+            `max_depth` calls away if given. With `reverse`, return the functions calling the given function.
+        """
+        index = self.index(name)
+
+        if index is None:
+            return [ ]
+
+        visited = set([ index ])
+        level   = [ index ]
+        depth   = 0
+
+        while level and (max_depth is None or depth < max_depth):
+            next_level = [ ]
+
+            for current in level:
+                for neighbour in self.neighbours(current, reverse):
+                    if neighbour not in visited:
+                        visited.add(neighbour)
+                        next_level.append(neighbour)
+
+            level  = next_level
+            depth += 1
+
+        visited.discard(index)
+
+        return sorted([ self.name(function) for function in visited ])
+
+    def paths(self, caller, callee, max_depth):
+        """ return the call paths from `caller` to `callee`, as lists of function names, of at most `max_depth` calls """
+        start, end = self.index(caller), self.index(callee)
+
+        if start is None or end is None:
+            return [ ]
+
+        # functions that can reach `callee` within the remaining depth, to prune the search
+        distance = { end: 0 }
+        level    = [ end ]
+
+        for depth in range(1, max_depth + 1):
+            next_level = [ ]
+
+            for current in level:
+                for neighbour in self.neighbours(current, True):
+                    if neighbour not in distance:
+                        distance[neighbour] = depth
+                        next_level.append(neighbour)
+
+            level = next_level
+
+        paths = [ ]
+        path  = [ start ]
+
+        def search(current):
+            if current == end and len(path) > 1:
+                paths.append([ self.name(function) for function in path ])
+                return
+
+            for neighbour in self.neighbours(current, False):
+                if neighbour in distance and len(path) + distance[neighbour] <= max_depth and (neighbour == end or neighbour not in path):
+                    path.append(neighbour)
+                    search(neighbour)
+                    path.pop()
+
+        if start in distance and distance[start] <= max_depth:
+            search(start)
+
+        return paths
+
+def main(argv):
+    queries = { '--callees': 'callees', '--callers': 'callers', '--all-callees': 'closure', '--all-callers': 'closure', '--paths': 'paths' }
+    query   = '--callers'
+    args    = [ ]
+
+    for arg in argv:
+        if arg in queries:
+            query = arg
+        else:
+            args.append(arg)
+
+    if len(args) < 2 or query == '--paths' and len(args) not in [ 3, 4 ]:
+        sys.stderr.write('Syntax: ' + os.path.basename(sys.argv[0]) + ' [--callees | --callers | --all-callees | --all-callers] calltree.cgraph function...\n')
+        sys.stderr.write('        ' + os.path.basename(sys.argv[0]) + ' --paths calltree.cgraph caller callee [max_depth]\n')
+        return 2
+
+    with CallGraphReader(args[0]) as graph:
+        if query == '--paths':
+            for path in graph.paths(args[1], args[2], int(args[3]) if len(args) > 3 else 8):
+                print(' -> '.join(path))
+        else:
+            for name in args[1:]:
+                if query == '--all-callers':
+                    functions = graph.closure(name, reverse = True)
+                else:
+                    functions = getattr(graph, queries[query])(name)
+
+                print(name + ': ' + ' '.join(functions))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -20,8 +20,14 @@
 
 import os
 import re
+import json
+import filecmp
+import hashlib
+import fnmatch
 
 import SCons.Node
+import SCons.Node.FS
+import SCons.Util
 import SCons.Environment
 import SCons.Script
 
@@ -70,6 +76,108 @@ def json_escape_string(string):
     """ escape a string for inclusion in the generated .json file """
     return '"' + string.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
+def format_entry(directory, file, command, output):
+    """ return the text for one entry in the generated .json file """
+    return '\n'.join\
+        ([
+            '    {',
+            '        "directory": ' + json_escape_string(directory) + ',',
+            '        "file":      ' + json_escape_string(file) + ',',
+            '        "command":   ' + json_escape_string(command) + ',',
+            '        "output":    ' + json_escape_string(output),
+            '    }'
+        ])
+
+class DatabaseWriter:
+    """
+        Write the entries of the .json file to a temporary file as they are generated, through a buffered
+        binary stream, so only the current entry is kept in memory. When closed, the temporary file replaces
+        the database file, only if the content is different.
+    """
+    def __init__(self, file_name, buffer_size = 256 * 1024):
+        self.file_name = file_name
+        self.temp_name = file_name + '.' + str(os.getpid()) + '.tmp'
+        self.output    = open(self.temp_name, 'wb', buffer_size)
+        self.offset    = 0
+        self.count     = 0
+
+        self.write_bytes(b'[\n')
+
+    def write_bytes(self, data):
+        self.output.write(data)
+        self.offset += len(data)
+
+    def write_entry(self, entry):
+        """ append an entry given as text or as bytes, and return the (offset, length) of the entry in the file """
+        if self.count:
+            self.write_bytes(b',\n')
+
+        self.count += 1
+        offset      = self.offset
+
+        self.write_bytes(base.to_bytes(entry))
+
+        return offset, self.offset - offset
+
+    def close(self):
+        """ complete the file and replace the database file if needed, return True if the database was replaced """
+        self.write_bytes(b'\n]\n' if self.count else b']\n')
+        self.output.close()
+
+        if os.path.exists(self.file_name) and filecmp.cmp(self.temp_name, self.file_name, shallow = False):
+            os.remove(self.temp_name)
+            return False
+
+        base.replace_file(self.temp_name, self.file_name)
+        return True
+
+    def discard(self):
+        self.output.close()
+
+        if os.path.exists(self.temp_name):
+            os.remove(self.temp_name)
+
+def database_stat(file_name):
+    try:
+        stat = os.stat(file_name)
+        return [ stat.st_size, repr(stat.st_mtime) ]
+    except OSError:
+        return None
+
+def entry_signature(options_key, obj, src, env):
+    """
+        return a hex digest for the compile command entry for the given object and source, over the object
+        build action signature already computed by SCons, the source names and the include path, so the
+        entry can be re-used from the previous run if the digest is the same.
+    """
+    binfo  = obj.get_binfo()
+    digest = hashlib.sha1()
+
+    keys = [ options_key, str(obj), str(src), str(getattr(binfo, 'bactsig', '')) ]
+    keys += [ str(obj_src) for obj_src in obj.sources ]
+    keys += [ str(inc) for inc in env.Flatten([ env.get('CPPPATH', [ ]) ]) ]
+
+    for key in keys:
+        digest.update(base.to_bytes(key + '\0'))
+
+    return digest.hexdigest()
+
+def read_state(state_file, options_key, database_file):
+    """
+        load the entries saved by the previous run in incremental mode, if the same options were used, and the
+        database file is still the one written by that run. The entries are given as (offset, length) in the
+        database file.
+    """
+    try:
+        state = json.loads(base.read_file(state_file, '{ }'))
+    except ValueError:
+        return { }
+
+    if state.get('options') != options_key or state.get('database') != database_stat(database_file):
+        return { }
+
+    return state.get('entries', { })
+
 def clone_build_env(env, overrides = { }):
     if isinstance(env, SCons.Environment.OverrideEnvironment) and '__subject' in env.__dict__:
         nested_overrides = { }
@@ -83,6 +191,163 @@ def clone_build_env(env, overrides = { }):
 
     return new_env.Clone()
 
+def build_env_key(env, overrides = { }):
+    """
+        return a key for the environment that clone_build_env() would return, made from the identity of the
+        base environment and the overrides applied on it, so object files built with the same environment
+        and overrides can share the same clone
+    """
+    if isinstance(env, SCons.Environment.OverrideEnvironment) and '__subject' in env.__dict__:
+        nested_overrides = { }
+        nested_overrides.update(env.__dict__['overrides'])
+        nested_overrides.update(overrides)
+
+        return build_env_key(env.__dict__['__subject'], nested_overrides)
+
+    return id(env), repr(sorted(overrides.items()))
+
+class FlagFilter:
+    """
+        Rules from $CCCOM_REMOVE_FLAGS and $CCCOM_APPEND_FLAGS, compiled once and applied on each cached build
+        environment, before the compile commands are expanded. A flag to be removed is matched against each
+        value of the named variable (the macro name for $CPPDEFINES) as:
+            - a regular expression, if it starts with 're:', like 're:-O[0-3s]'
+            - a shell wildcard pattern, if it includes any of '*?[', like '-fprofile-*'
+            - the exact value otherwise
+        The flags to be appended are added to the named variables with env.Append().
+    """
+    def __init__(self, remove_flags, append_flags, env):
+        self.rules  = { }           # variable name: (set of exact values, list of compiled patterns)
+        self.append = append_flags
+
+        for filter_set in remove_flags:
+            for var_name in filter_set:
+                flags, patterns = self.rules.setdefault(var_name, (set(), [ ]))
+
+                for flag in env.Split(filter_set[var_name]):
+                    if flag.startswith('re:'):
+                        patterns.append(re.compile('(?:' + flag[len('re:'):] + r')\Z'))
+                    elif re.search(r'[*?[]', flag):
+                        patterns.append(re.compile(fnmatch.translate(flag)))
+                    else:
+                        flags.add(flag)
+
+    def is_removed(self, var_name, value):
+        flags, patterns = self.rules[var_name]
+
+        if isinstance(value, (tuple, list)):
+            value = value[0] if value else ''   # (name, value) macro definition
+
+        value = str(value)
+
+        if value in flags:
+            return True
+
+        for pattern in patterns:
+            if pattern.match(value):
+                return True
+
+        return False
+
+    def apply(self, build_env):
+        """ remove and append the flags in the variables of the (cloned) build environment """
+        for var_name in self.rules:
+            if var_name not in build_env:
+                continue
+
+            value = build_env[var_name]
+
+            if SCons.Util.is_String(value):
+                values = value.split()
+                kept   = [ item for item in values if not self.is_removed(var_name, item) ]
+
+                if len(kept) != len(values):
+                    build_env[var_name] = ' '.join(kept)
+            elif SCons.Util.is_Dict(value):
+                build_env[var_name] = dict([ (name, item) for name, item in value.items() if not self.is_removed(var_name, name) ])
+            elif SCons.Util.is_Sequence(value):
+                kept = [ item for item in value if not self.is_removed(var_name, item) ]
+
+                if len(kept) != len(value):
+                    build_env[var_name] = value.__class__(kept)
+
+        for flag_set in self.append:
+            build_env.Append(**flag_set)
+
+build_files_re = re.compile(r'\$\{?\s*(?:(?:UN)?CHANGED_)?(?:TARGETS?|SOURCES?)\b')
+identifier_re  = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+def value_strings(value):
+    """ generate the strings in a construction variable value, from nested lists and dictionaries """
+    if SCons.Util.is_String(value):
+        yield str(value)
+    elif SCons.Util.is_Dict(value):
+        for name, item in value.items():
+            for string in value_strings(name):
+                yield string
+            for string in value_strings(item):
+                yield string
+    elif SCons.Util.is_Sequence(value):
+        for item in value:
+            for string in value_strings(item):
+                yield string
+
+def references_build_files(build_env, var_name, visited):
+    """
+        check if the variable refers to $TARGET or $SOURCE (or $TARGETS, $SOURCES, $CHANGED_SOURCES, ...), like
+        `${TARGET.dir}` or `${SOURCE.srcdir}`, directly or through the other variables it names. The names passed
+        as arguments in a call, like `${_concat(..., TARGET, SOURCE)}` in $_CPPINCFLAGS, are not references, but
+        the variables in the same call are checked. Functions (callable values) are not inspected.
+    """
+    if var_name in visited or var_name not in build_env:
+        return False
+
+    visited.add(var_name)
+
+    for string in value_strings(build_env[var_name]):
+        if build_files_re.search(string):
+            return True
+
+        if '$' in string:
+            for name in identifier_re.findall(string):
+                if references_build_files(build_env, name, visited):
+                    return True
+
+    return False
+
+def expand_build_env(build_env, var_list, build_targets, build_sources):
+    """
+        replace the variables in `var_list` with their expansion for the first object file built with the
+        cached environment, so they are not expanded again for each of the other object files. Variables that
+        refer to $TARGET or $SOURCE are left in place, to be expanded for each object file.
+    """
+    for var_name in var_list:
+        if var_name in build_env and not references_build_files(build_env, var_name, set()):
+            build_env[var_name] = build_env.subst('$' + var_name, False, build_targets, build_sources).replace('$', '$$')
+
+def walk_object_files(root_list, obj_ixes, visited, stop = ()):
+    """
+        generate the object files found in the dependency tree of the given root nodes, in depth-first order.
+        The walk does not descend below object files and source files, so the scanned `#include` dependencies
+        are never visited, and `visited` is shared by all the roots, so static libraries linked in more than
+        one binary are only walked once. Nodes in `stop` (other than the roots) are not walked either.
+    """
+    for root in root_list:
+        pending = [ root ]
+
+        while pending:
+            node = pending.pop()
+
+            if node in visited:
+                continue
+
+            visited.add(node)
+
+            if base.is_object_file(node, obj_ixes):
+                yield node
+            elif node is root or node not in stop and (node.is_derived() or isinstance(node, SCons.Node.FS.Dir)):
+                pending.extend(reversed(node.children()))
+
 def write_compile_commands(target, source, env):
     """
         generator function to write the compilation database file (default 'compile_commands.json') for
@@ -93,114 +358,156 @@ def write_compile_commands(target, source, env):
     getBool   = base.BindCallArguments(base.getBool,   target, source, env, lambda x: x)
 
     obj_ixes = \
-        map(getString, [ 'CCCOM_OBJPREFIX',  'CCCOM_OBJSUFFIX', 'CCCOM_SHOBJPREFIX', 'CCCOM_SHOBJSUFFIX' ])
+        list(map(getString, [ 'CCCOM_OBJPREFIX',  'CCCOM_OBJSUFFIX', 'CCCOM_SHOBJPREFIX', 'CCCOM_SHOBJSUFFIX' ]))
 
     cc_suffixes = \
         getList('CCCOM_SUFFIXES')
 
     source            = env.Flatten(source)
     suffix_map        = build_suffix_map(target, source, env)
-    has_previous_unit = False
     keep_variant_dir  = getBool('CCCOM_KEEP_VARIANT_DIR')
+    abs_file_path     = getBool('CCCOM_ABSOLUTE_FILE')
+    expand_vars       = getList('CCCOM_EXPAND_ONCE') if 'CCCOM_FILTER_FUNC' not in env else [ ]
+    env_cache         = { }
+    flag_filter       = FlagFilter(getList('CCCOM_REMOVE_FLAGS'), getList('CCCOM_APPEND_FLAGS'), env)
+
+    # the entries can not be re-used when the filter function changes them, as changes in the function are not known
+    incremental       = getBool('CCCOM_INCREMENTAL') and 'CCCOM_FILTER_FUNC' not in env
+    state_file        = str(target[0]) + getString('CCCOM_STATE_SUFFIX')
+    directory         = env.fs.getcwd().get_abspath()
+
+    options_key = \
+        repr\
+            ([
+                directory, keep_variant_dir, abs_file_path, expand_vars, cc_suffixes,
+                getList('CCCOM_REMOVE_FLAGS'), getList('CCCOM_APPEND_FLAGS'), getList('CCCOM_COMMANDVAR'), getList('CCCOM_SHCOMMANDVAR')
+            ])
+
+    previous_entries  = read_state(state_file, options_key, str(target[0])) if incremental else { }
+    previous_database = open(str(target[0]), 'rb') if previous_entries else None
+    current_entries   = { }
+    writer            = DatabaseWriter(str(target[0]))
+
+    try:
+        for child in walk_object_files(source, obj_ixes, set(), set(env.get('CCCOM_SHARD_STOP', [ ]))):
+            for child_src in child.sources:
+                if is_cc_source(child_src, cc_suffixes):
+                    node_env = child.get_build_env()
+
+                    if incremental:
+                        entry_id  = str(child) + '\n' + str(child_src)
+                        signature = entry_signature(options_key, child, child_src, node_env)
+
+                        # entries with no offset may be left by older runs with $CCCOM_FILTER_FUNC
+                        if entry_id in previous_entries and previous_entries[entry_id][0] == signature and previous_entries[entry_id][1] is not None:
+                            signature, offset, length = previous_entries[entry_id]
+
+                            previous_database.seek(offset)
+                            offset, length = writer.write_entry(previous_database.read(length))
+
+                            current_entries[entry_id] = [ signature, offset, length ]
+
+                            continue
+
+                    build_targets = [ child ] + child.alter_targets()[0]
+
+                    if keep_variant_dir:
+                        build_sources = child.sources
+                    else:
+                        build_sources = [ obj_src.srcnode() for obj_src in child.sources ]
+
+                    env_key  = build_env_key(node_env)
+
+                    if env_key not in env_cache:
+                        build_env = clone_build_env(node_env)
+                        flag_filter.apply(build_env)
+                        expand_build_env(build_env, expand_vars, build_targets, build_sources)
+
+                        env_cache[env_key] = build_env
+
+                    build_env = env_cache[env_key]
+
+                    if 'CCCOM_FILTER_FUNC' in env:
+                        # the filter function may change the environment for this source only
+                        build_env = build_env.Clone()
+                        build_env['CCCOM_FILTER_FUNC'] = env['CCCOM_FILTER_FUNC']
+                        build_env['CCCOM_ENV'] = env
+                        val = base.getBool(build_targets, build_sources, build_env, lambda x: x, 'CCCOM_FILTER_FUNC')
+                        if not val:
+                            continue
+
+                    if keep_variant_dir:
+                        src_file = child_src
+                    else:
+                        src_file = child_src.srcnode()
+
+                    if abs_file_path:
+                        src_file = src_file.get_abspath()
+                    else:
+                        src_file = src_file.get_path()
+
+                    entry = \
+                        format_entry\
+                            (
+                                directory,
+                                src_file,
+                                build_env.subst\
+                                    (
+                                        get_build_command(obj_ixes, suffix_map, child, child_src, build_env),
+                                        False,
+                                        build_targets,
+                                        build_sources,
+                                        None
+                                    ),
+                                env.subst('$TARGET', False, build_targets, build_sources)
+                            )
+
+                    offset, length = writer.write_entry(entry)
+
+                    if incremental:
+                        current_entries[entry_id] = [ signature, offset, length ]
+    except:
+        writer.discard()
+        raise
+    finally:
+        if previous_database:
+            previous_database.close()
+
+    # keep the file unchanged if possible, so tools watching it do not have to parse all sources again
+    writer.close()
+
+    if incremental:
+        base.write_file\
+            (
+                state_file,
+                json.dumps({ 'options': options_key, 'database': database_stat(str(target[0])), 'entries': current_entries })
+            )
 
-    db_file = [ '[' ]
-
-    for src in source:
-        nodeWalker = SCons.Node.Walker(src)
-        child = nodeWalker.get_next()
-
-        while child:
-            if base.is_object_file(child, obj_ixes):
-                for child_src in child.sources:
-                    if is_cc_source(child_src, cc_suffixes):
-                        build_env = clone_build_env(child.get_build_env())
-
-                        build_targets = [ child ] + child.alter_targets()[0]
-
-                        if keep_variant_dir:
-                            build_sources = child.sources
-                        else:
-                            build_sources = [ obj_src.srcnode() for obj_src in child.sources ]
-
-                        append_flags = getList('CCCOM_APPEND_FLAGS')
-                        filter_flags = getList('CCCOM_REMOVE_FLAGS')
-                        abs_file_path = getBool('CCCOM_ABSOLUTE_FILE')
-
-                        if not keep_variant_dir or append_flags or filter_flags or 'CCCOM_FILTER_FUNC' in env:
-                            for filter_set in filter_flags:
-                                for var_name in filter_set:
-                                    if var_name in build_env:
-                                        for val in env.Split(filter_set[var_name]):
-                                            if val in build_env[var_name]:
-                                                if val in build_env[var_name]:
-                                                    if isinstance(build_env[var_name], str):
-                                                        build_env[var_name] = re.sub(r'(^|\s+)' + re.escape(val) + r'(\s+|$)', ' ', build_env[var_name])
-                                                    else:
-                                                        while val in build_env[var_name]:
-                                                            build_env[var_name].remove(val)
-
-                            for flag_set in append_flags:
-                                build_env.Append(**flag_set)
-
-                            if 'CCCOM_FILTER_FUNC' in env:
-                                build_env['CCCOM_FILTER_FUNC'] = env['CCCOM_FILTER_FUNC']
-                                build_env['CCCOM_ENV'] = env
-                                val = base.getBool(build_targets, build_sources, build_env, lambda x: x, 'CCCOM_FILTER_FUNC')
-                                if not val:
-                                    continue
-
-                        if has_previous_unit:
-                            db_file.append('    },')
-
-                        has_previous_unit = True
-
-                        db_file.extend\
-                            ([
-            '    {',
-            '        "directory": ' + json_escape_string(build_env.fs.getcwd().get_abspath()) + ','
-                            ])
-
-                        if keep_variant_dir:
-                            src_file = child_src
-                        else:
-                            src_file = child_src.srcnode()
-
-                        if abs_file_path:
-                            src_file = src_file.get_abspath()
-                        else:
-                            src_file = src_file.get_path()
-
-                        db_file.extend\
-                            ([
-            '        "file":      ' + json_escape_string(src_file) + ',',
-            '        "command":   '
-                    +
-                json_escape_string\
-                    (
-                        build_env.subst\
-                        (
-                            get_build_command(obj_ixes, suffix_map, child, child_src, build_env),
-                            False,
-                            build_targets,
-                            build_sources,
-                            None
-                        )
-                    ) + ',',
-            '        "output":    '
-                    +
-                json_escape_string(env.subst('$TARGET', False, build_targets, build_sources))
-                            ])
-            child = nodeWalker.get_next()
-
-    if has_previous_unit:
-        db_file.append('    }')
-
-    db_file.append(']')
-
-    with open(str(target[0]), 'w') as output_file:
-        for line in db_file:
-            output_file.write(line + '\n')
+def merge_compile_commands(target, source, env):
+    """
+        Action function for the top-level compilation database in $CCCOM_SHARDED mode: concatenate the
+        entries from the fragment files given as sources, listing each source and object file only once.
+    """
+
+    listed = set()
+    writer = DatabaseWriter(str(target[0]))
 
+    try:
+        for fragment in source:
+            with open(str(fragment), 'rb') as fragment_file:
+                entries = json.loads(fragment_file.read().decode('utf-8'))
+
+            for entry in entries:
+                key = (entry['file'], entry.get('output', ''))
+
+                if key not in listed:
+                    listed.add(key)
+                    writer.write_entry(format_entry(entry['directory'], entry['file'], entry['command'], entry.get('output', '')))
+    except:
+        writer.discard()
+        raise
+
+    writer.close()
 
 CompileCommandsBuilder = SCons.Script.Builder\
             (
@@ -209,6 +516,16 @@ CompileCommandsBuilder = SCons.Script.Builder\
                 suffix = '.json'
             )
 
+MergeCompileCommandsBuilder = SCons.Script.Builder\
+            (
+                action = SCons.Script.Action(merge_compile_commands, "$CCCOM_MERGE_STR"),
+                suffix = '.json'
+            )
+
+def shard_file_name(node):
+    """ file name for the compilation database fragment of a library or program target """
+    return (re.sub(r'[^\w+-]+', '_', str(node)).strip('_') or 'top') + '.json'
+
 def JSONCompilationDatabase(env, *args, **kw):
     """
         pseudo-builder (environement method) to translate source and target arguments as needed for the
@@ -216,6 +533,7 @@ def JSONCompilationDatabase(env, *args, **kw):
     """
 
     getString = base.BindCallArguments(base.getString, None, None, env, None)
+    getBool   = base.BindCallArguments(base.getBool,   None, None, env, None)
 
     if len(args) == 0:
         target, source = [ getString('CCCOM_DATABASE_FILE') ], [ '.' ]
@@ -225,7 +543,43 @@ def JSONCompilationDatabase(env, *args, **kw):
         else:
             target, source = env.Flatten(args[0]), env.Flatten(args[1:])
 
-    return CompileCommandsBuilder(env, target, source, **kw)
+    if getBool('CCCOM_SHARDED'):
+        # one fragment per library or program, each one only re-generated when its own object files change
+        shard_dir = env.Dir(getString('CCCOM_SHARDDIR'))
+        roots     = env.arg2nodes(source, env.fs.Entry)
+        fragments = [ ]
+
+        for root in roots:
+            # the object files of the other libraries and programs are listed in their own fragments
+            shard_kw = dict(kw)
+            shard_kw['CCCOM_SHARD_STOP'] = [ node for node in roots if node is not root ]
+
+            fragments.extend(compile_commands_target(env, [ shard_dir.File(shard_file_name(root)) ], [ root ], **shard_kw))
+
+        result = MergeCompileCommandsBuilder(env, target, fragments)
+
+        env.Precious(result)
+        env.Clean(result, shard_dir)
+
+        return result
+
+    return compile_commands_target(env, target, source, **kw)
+
+def compile_commands_target(env, target, source, **kw):
+    """ call the CompileCommandsBuilder(), and keep the previous database file for comparing with the new content """
+    getString = base.BindCallArguments(base.getString, None, None, env, None)
+    getBool   = base.BindCallArguments(base.getBool,   None, None, env, None)
+
+    result = CompileCommandsBuilder(env, target, source, **kw)
+
+    # SCons would otherwise remove the file before the build
+    env.Precious(result)
+
+    if getBool('CCCOM_INCREMENTAL'):
+        for tgt in result:
+            env.Clean(tgt, str(tgt) + getString('CCCOM_STATE_SUFFIX'))
+
+    return result
 
 def exists(env):
     """ Check if needed commands for generating comilation database file are present """
@@ -234,7 +588,8 @@ def exists(env):
 def generate(env, **kw):
     """ Populate construction variables in `env` environment needed for CompileCommands() builder:
             $CCCOM_OBJPREFIX, $CCCOM_OBJSUFFIX, $CCCOM_SHOBJPREFIX, $CCCOM_SHOBJSUFFIX,
-            $CCCOM_SUFFIXES, $CCCOM_DATABASE_FILE
+            $CCCOM_SUFFIXES, $CCCOM_DATABASE_FILE, $CCCOM_EXPAND_ONCE, $CCCOM_INCREMENTAL, $CCCOM_STATE_SUFFIX,
+            $CCCOM_SHARDED, $CCCOM_SHARDDIR
 
         Attaches CompileCommands() and CompilationDatabase() builders to the environment.
     """
@@ -266,7 +621,13 @@ def generate(env, **kw):
             CCCOM_REMOVE_FLAGS     = [ ],
             # CCCOM_FILTER_FUNC      = lambda target, source, env, for_signature: True
             CCCOM_ABSOLUTE_FILE    = False,
-            CCCOM_STR              = "Writing $TARGET"
+            CCCOM_EXPAND_ONCE      = [ '_CCCOMCOM' ],
+            CCCOM_INCREMENTAL      = False,
+            CCCOM_STATE_SUFFIX     = '.state',
+            CCCOM_SHARDED          = False,
+            CCCOM_SHARDDIR         = 'compile_commands.d',
+            CCCOM_STR              = "Writing $TARGET",
+            CCCOM_MERGE_STR        = "Merging $TARGET"
         )
 
     env.AddMethod(JSONCompilationDatabase, 'CompileCommands')
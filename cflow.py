@@ -24,9 +24,11 @@
 
 import sys
 import os
-import subprocess
+import hashlib
 import SCons.Script
+import SCons.Scanner
 import source_browse_base as base
+import call_graph
 
 """ default name for `cflow` executable command """
 cflow_bin = 'cflow'
@@ -38,13 +40,9 @@ def collect_source_dependencies(target, source, env):
 
     getBool     = base.BindCallArguments(base.getBool,     target, source, env, None)
 
-    keys_list = env['CFLOWFORMAT'].keys()
-
     del target[0]
 
-    keys_list.sort()
-    keys_list.reverse()
-    for k in keys_list:
+    for k in sorted(env['CFLOWFORMAT'].keys(), reverse = True):
         target.insert(0,  ''.join([ ext[0], k, ext[1] ]))
 
     if 'CFLOWCONFIG' in env:
@@ -53,6 +51,15 @@ def collect_source_dependencies(target, source, env):
                 if os.path.exists(config):
                     env.Depends(tgt, config)
 
+    if getBool('CFLOWGRAPH'):
+        target.append(ext[0] + env['CFLOWGRAPHSUFFIX'])
+
+    if getBool('CFLOWPERUNIT'):
+        env.Clean(target, cache_directory(target, 'CFLOWUNITCACHEDIR', env))
+
+    if getBool('CFLOWCPPCACHE'):
+        env.Clean(target, cache_directory(target, 'CFLOWCPPCACHEDIR', env))
+
     keepVariantDir = getBool('CFLOWKEEPVARIANTDIR')
 
     return base.collect_source_dependencies(keepVariantDir, target, source, env, 'CFLOWSUFFIXES')
@@ -93,12 +100,16 @@ def run_cflow(target, source, env):
     variant_dir = target[0].cwd
     cflow_dir   = variant_dir.Dir(getFile('CFLOWDIRECTORY'))
 
-    command = env.Split(env['CFLOW']) + env.Split(env['CFLOWFLAGS']) + (env.subst(env.Split(env['CFLOWCPP'])) if 'CFLOWCPP' in env else [ ])
+    preprocess = len(env.Split(env['CFLOWCPP'])) and getBool('CFLOWCPPCACHE')
+
+    command = env.Split(env['CFLOW']) + env.Split(env['CFLOWFLAGS']) + (env.subst(env.Split(env['CFLOWCPP'])) if 'CFLOWCPP' in env and not preprocess else [ ])
     command[0] = base.translate_path_executable(command[0], str(variant_dir), str(cflow_dir), env)
 
+    cpp_flags = [ ]
+
     if len(env.Split(env['CFLOWCPP'])):
-        for definition in env.Split(env['CFLOWSDEF']):
-            command += env.Split(env['CFLOWSDEFFLAG']) + [ definition ]
+        for definition in env.Split(env['CFLOWDEF']):
+            cpp_flags += env.Split(env['CFLOWDEFFLAG']) + [ definition ]
 
         inc_path = \
             base.translate_include_path\
@@ -111,32 +122,352 @@ def run_cflow(target, source, env):
                 )
 
         for inc in inc_path:
-            command += env.Split(env['CFLOWPATHFLAG']) + [ inc ]
+            cpp_flags += env.Split(env['CFLOWPATHFLAG']) + [ inc ]
+
+    if not preprocess:
+        command += cpp_flags
 
     for sym in env.Split(env['CFLOWSYM']):
         command += env.Split(env['CFLOWSYMFLAG']) + [ sym ]
 
-    keys_list = env['CFLOWFORMAT'].keys()
-    keys_list.sort()
+    formats    = sorted(env['CFLOWFORMAT'].keys())
+    outputs    = dict(zip(formats, [ str(tgt) for tgt in target ]))
+    sources    = [ base.translate_relative_path(str(src), '.', str(cflow_dir)) for src in source ]
 
-    target_index = 0
+    if preprocess:
+        rc, sources = preprocess_sources(cpp_flags, source, sources, cflow_dir, target, env)
 
-    for nested_ext in keys_list:
-        format_command = command[:]
-        format_command += env.Split(env['CFLOWFORMAT'][nested_ext]) + env.Split(env['CFLOWOUTPUTFLAG']) + \
-                [ base.translate_relative_path(str(target[target_index]), '.', str(cflow_dir)) ]
-        format_command += [ base.translate_relative_path(str(src), '.', str(cflow_dir)) for src in source ]
+        if rc:
+            return rc
 
-        target_index = target_index + 1
+    graph_file      = str(target[len(formats)]) if getBool('CFLOWGRAPH') else None
+    derived_outputs = { }
 
-        print\
-            (
-                '(cd ' + ' '.join(base.shell_escape([ str(cflow_dir) ]))
-                        + ' && ' +
-                ' '.join(base.shell_escape(format_command))
-            )
+    if getBool('CFLOWSINGLEPASS') or getBool('CFLOWPERUNIT'):
+        # the cross-reference can only be merged from the outputs for each source
+        derived_flags = [ [ ], env.Split(env['CFLOWREVERSEFLAG']) ]
+
+        if getBool('CFLOWPERUNIT'):
+            derived_flags.append(env.Split(env['CFLOWXREFFLAG']))
+
+        derived         = [ nested_ext for nested_ext in formats if env.Split(env['CFLOWFORMAT'][nested_ext]) in derived_flags ]
+        derived_outputs = dict([ (nested_ext, outputs[nested_ext]) for nested_ext in derived ])
+        formats         = [ nested_ext for nested_ext in formats if nested_ext not in derived ]
+
+        if getBool('CFLOWPERUNIT') and (derived or graph_file):
+            rc = run_cflow_per_unit(command, source, sources, derived_outputs, graph_file, cflow_dir, target, env)
+
+            if rc:
+                return rc
+
+            derived_outputs = { }
+            graph_file      = None
+
+    format_commands = \
+        [
+            command + env.Split(env['CFLOWFORMAT'][nested_ext]) + env.Split(env['CFLOWOUTPUTFLAG']) +
+                [ base.translate_relative_path(outputs[nested_ext], '.', str(cflow_dir)) ] + sources
+                    for nested_ext in formats
+        ]
+
+    # the calls for the call graph are listed by one more `cflow` command, run together with the other formats
+    calls_command = command + env.Split(env['CFLOWCALLSFLAGS']) + sources if derived_outputs or graph_file else None
+
+    rc, calls_output = run_cflow_formats(formats, format_commands, calls_command, cflow_dir, env)
+
+    if rc or calls_command is None:
+        return rc
+
+    graph = call_graph.CallGraph()
+    graph.add_tree(decode(calls_output).splitlines())
+
+    write_cflow_formats(graph, derived_outputs, graph_file, env)
+
+    return 0
+
+def run_cflow_formats(formats, commands, calls_command, cflow_dir, env):
+    """
+        Run the `cflow` commands for the output formats, up to $CFLOWJOBS at the same time. The standard
+        output and error for each command are reported after the command completes, with the run time.
+        If given, `calls_command` runs together with the other commands, and its standard output is returned
+        with the exit code, instead of being reported.
+    """
+    def run_format(command):
+        return base.run_command(command, cwd = str(cflow_dir), env = env['ENV'], capture_stdout = True, echo_stderr = False)
+
+    labels = [ 'cflow format ' + repr(nested_ext) for nested_ext in formats ]
+
+    if calls_command is not None:
+        commands = commands + [ calls_command ]
+        labels   = labels + [ 'cflow calls' ]
+
+    for command in commands:
+        print_command(command, cflow_dir)
+
+    results      = base.run_parallel(run_format, commands, int(env['CFLOWJOBS']))
+    rc           = 0
+    calls_output = None
+
+    for command, label, result in zip(commands, labels, results):
+        if command is calls_command:
+            calls_output = result.stdout
+        else:
+            base.write_output(sys.stdout, result.stdout)
+
+        base.write_output(sys.stderr, result.stderr)
+
+        print(label + ': ' + result.timing_summary())
+
+        if result.returncode and not rc:
+            sys.stderr.write("cflow command exited with code: " + str(result.returncode) + '\n')
+            rc = result.returncode
+
+    return rc, calls_output
+
+def print_command(command, cflow_dir):
+    print\
+        (
+            '(cd ' + ' '.join(base.shell_escape([ str(cflow_dir) ]))
+                    + ' && ' +
+            ' '.join(base.shell_escape(command))
+        )
+
+def run_cflow_command(command, cflow_dir, env):
+    """ print and run a `cflow` command in the output directory, with the standard output captured """
+    print_command(command, cflow_dir)
+
+    return base.run_command(command, cwd = str(cflow_dir), env = env['ENV'], capture_stdout = True)
+
+def decode(data):
+    """ translate bytes output by `cflow` to native str """
+    return data if str is bytes else data.decode('utf-8', 'surrogateescape')
+
+def open_output(file_name):
+    """ open an output file for text produced by decode() """
+    if str is bytes:
+        return open(file_name, 'w')
+
+    return open(file_name, 'w', encoding = 'utf-8', errors = 'surrogateescape')
+
+def tree_roots(graph, flags):
+    """ return the functions at the top of the direct tree, for the `--all` and `--main` options in `flags` """
+    all_count = flags.count('--all') + flags.count('-A') + 2 * flags.count('-AA')
+
+    if all_count:
+        return graph.global_functions(include_static = all_count > 1)
+
+    main = 'main'
+
+    for index, flag in enumerate(flags):
+        if flag.startswith('--main='):
+            main = flag[len('--main='):]
+        elif flag in [ '--main', '-m' ] and index + 1 < len(flags):
+            main = flags[index + 1]
+
+    return [ main ] if main in graph.definitions else [ ]
+
+def write_cflow_formats(graph, outputs, graph_file, env):
+    """
+        Write the direct tree, reverse tree and cross-reference outputs from the call graph. `outputs` maps
+        each nested extension to the output file name. The binary call graph is also written if `graph_file`
+        is given.
+    """
+    if graph_file:
+        graph.write_binary(graph_file)
+
+    for nested_ext, output_file in outputs.items():
+        flags = env.Split(env['CFLOWFORMAT'][nested_ext])
+
+        with open_output(output_file) as output:
+            if flags == env.Split(env['CFLOWXREFFLAG']):
+                graph.write_xref(output)
+            elif flags == env.Split(env['CFLOWREVERSEFLAG']):
+                graph.write_reverse_tree(output)
+            else:
+                graph.write_tree(output, tree_roots(graph, env.Split(env['CFLOWFLAGS'])))
+
+""" scanner for the `#include` files of a source, searched in $CFLOWPATH """
+include_scanner = \
+    SCons.Scanner.ClassicCPP\
+        (
+            'CFlowIncludeScanner',
+            '$CPPSUFFIXES',
+            'CFLOWPATH',
+            r'^[ \t]*#[ \t]*(?:include|import)[ \t]*(<|")([^>"]+)(>|")'
+        )
+
+def cache_directory(target, cache_var, env):
+    """ return the cache directory named in `cache_var` for the target, with a subdirectory for each target """
+    return target[0].dir.Dir(env[cache_var]).Dir(target[0].name)
+
+def include_closure(node, env, path, includes_cache):
+    """
+        Return the sorted list of files included by the source `node`, directly or indirectly, found with
+        the include_scanner. `includes_cache` keeps the included files for each header already scanned.
+    """
+    closure = { }
+    pending = [ node ]
+
+    while pending:
+        current = pending.pop()
+
+        if current not in includes_cache:
+            includes_cache[current] = include_scanner(current, env, path)
+
+        for include in includes_cache[current]:
+            if include not in closure and include.exists():
+                closure[include] = True
+                pending.append(include)
+
+    return sorted(closure.keys(), key = str)
+
+def unit_signature(command, node, source_name, env, path, includes_cache):
+    """
+        Return the hex digest over the `cflow` command, the source file name and content, and the content of
+        the included files if $CFLOWCPP is set, used to name the cached cross-reference for the source.
+    """
+    digest = hashlib.sha1()
+
+    for arg in command + [ source_name, node.get_csig() ]:
+        digest.update(base.to_bytes(arg + '\0'))
+
+    if len(env.Split(env['CFLOWCPP'])):
+        for include in include_closure(node, env, path, includes_cache):
+            digest.update(base.to_bytes(str(include) + '\0' + include.get_csig() + '\0'))
+
+    return digest.hexdigest()
+
+def preprocessor_command(env):
+    """ return the pre-processor command given with the `--cpp=COMMAND` option in $CFLOWCPP, or `cpp` as `cflow` does """
+    for option in env.Split(env['CFLOWCPP']):
+        option = env.subst(option)
+
+        if option.startswith('--cpp='):
+            return env.Split(option[len('--cpp='):])
+
+    return [ 'cpp' ]
+
+def preprocess_sources(cpp_flags, source, sources, cflow_dir, target, env):
+    """
+        Pre-process each source once, up to $CFLOWJOBS at the same time, into $CFLOWCPPCACHEDIR/<target>, and
+        return the exit code and the list of pre-processed files to be given to `cflow` instead of the sources.
+        The output for each source is named after the unit_signature() of the pre-processor command, that
+        includes the content of the source and of the included files, so unchanged sources are not
+        pre-processed again.
+    """
+    cache_dir = str(cache_directory(target, 'CFLOWCPPCACHEDIR', env))
+    command   = preprocessor_command(env) + cpp_flags
+    path      = include_scanner.path(env, cflow_dir)
+    includes  = { }
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    units = [ ]
+
+    for node, source_name in zip(source, sources):
+        suffix = '.i' if os.path.splitext(source_name)[1] in [ '.c', '.y' ] else '.ii'
+        units.append((os.path.join(cache_dir, unit_signature(command, node, source_name, env, path, includes) + suffix), source_name))
+
+    def run_unit(unit):
+        output_file, source_name = unit
+
+        if os.path.exists(output_file):
+            return 0
+
+        result = run_cflow_command(command + [ source_name ], cflow_dir, env)
+
+        if result.returncode:
+            return result.returncode
+
+        temp_name = output_file + '.' + str(os.getpid()) + '.tmp'
+
+        with open(temp_name, 'wb') as output:
+            output.write(result.stdout)
+
+        base.replace_file(temp_name, output_file)
+
+        return 0
+
+    for rc in base.run_parallel(run_unit, units, int(env['CFLOWJOBS'])):
+        if rc:
+            sys.stderr.write("cflow pre-processor command exited with code: " + str(rc) + '\n')
+            return rc, None
+
+    outputs = set([ os.path.basename(output_file) for output_file, source_name in units ])
+
+    for name in os.listdir(cache_dir):
+        if name not in outputs and os.path.splitext(name)[1] in [ '.i', '.ii' ]:
+            os.remove(os.path.join(cache_dir, name))
+
+    return 0, [ base.translate_relative_path(output_file, '.', str(cflow_dir)) for output_file, source_name in units ]
+
+def run_cflow_per_unit(command, source, sources, outputs, graph_file, cflow_dir, target, env):
+    """
+        Run `cflow` for the calls (and the cross-reference, if needed) of each source separately, up to
+        $CFLOWJOBS at the same time, and write the outputs from the merged call graph. The output for each
+        source is cached in $CFLOWUNITCACHEDIR/<target>, named after the unit_signature(), so only modified
+        sources run `cflow` again.
+    """
+    cache_dir = str(cache_directory(target, 'CFLOWUNITCACHEDIR', env))
+    path      = include_scanner.path(env, cflow_dir)
+    includes  = { }
+    kinds     = [ ('.calls', env.Split(env['CFLOWCALLSFLAGS'])) ]
+
+    if [ nested_ext for nested_ext in outputs if env.Split(env['CFLOWFORMAT'][nested_ext]) == env.Split(env['CFLOWXREFFLAG']) ]:
+        kinds.append(('.xref', env.Split(env['CFLOWXREFFLAG'])))
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    units = \
+        [
+            (os.path.join(cache_dir, unit_signature(command + flags, node, source_name, env, path, includes) + ext), command + flags + [ source_name ])
+                for ext, flags in kinds
+                    for node, source_name in zip(source, sources)
+        ]
+
+    def run_unit(unit):
+        fragment, unit_command = unit
+
+        if not os.path.exists(fragment):
+            result = run_cflow_command(unit_command, cflow_dir, env)
+
+            if result.returncode:
+                return result.returncode, None
+
+            temp_name = fragment + '.' + str(os.getpid()) + '.tmp'
+
+            with open(temp_name, 'wb') as output:
+                output.write(result.stdout)
+
+            base.replace_file(temp_name, fragment)
+
+        with open(fragment, 'rb') as fragment_file:
+            return 0, decode(fragment_file.read())
+
+    results = base.run_parallel(run_unit, units, int(env['CFLOWJOBS']))
+    graph   = call_graph.CallGraph()
+
+    for (fragment, unit_command), (rc, text) in zip(units, results):
+        if rc:
+            sys.stderr.write("cflow command exited with code: " + str(rc) + '\n')
+            return rc
+
+        if fragment.endswith('.xref'):
+            graph.add_xref(text.splitlines())
+        else:
+            graph.add_tree(text.splitlines())
+
+    fragments = set([ os.path.basename(fragment) for fragment, unit_command in units ])
+
+    for name in os.listdir(cache_dir):
+        if name not in fragments and os.path.splitext(name)[1] in [ '.calls', '.xref' ]:
+            os.remove(os.path.join(cache_dir, name))
+
+    write_cflow_formats(graph, outputs, graph_file, env)
 
-        cflow_process = subprocess.check_output(format_command, cwd = str(cflow_dir), env = env['ENV'])
+    return 0
 
 def exists(env):
     """ Check if `cflow` tool is imported in the environment """
@@ -149,8 +480,10 @@ def generate(env, **kw):
     """
         Populate environment with variables for the CFlowTree() builder:
 
-            $CFLOW, $CFLOWOUTPUTFLAG, $CFLOWFLAGS, $CFLOWCONFIG, $CFLOWPATHFLAG, $CFLOWPATH, $CFLOWDEFSUFFIXESa, $CFLOWSDEFFLAG, $CFLOWDEF,
-            $CFLOWFORMAT, $CFLOWSYMFLAGS, $CFLOWSYM, $CFLOWSUFFIXES, $CFLOWCPP
+            $CFLOW, $CFLOWOUTPUTFLAG, $CFLOWFLAGS, $CFLOWCONFIG, $CFLOWPATHFLAG, $CFLOWPATH, $CFLOWDEFSUFFIXESa, $CFLOWDEFFLAG, $CFLOWDEF,
+            $CFLOWFORMAT, $CFLOWSYMFLAGS, $CFLOWSYM, $CFLOWSUFFIXES, $CFLOWCPP, $CFLOWSINGLEPASS, $CFLOWCALLSFLAGS,
+            $CFLOWXREFFLAG, $CFLOWREVERSEFLAG, $CFLOWJOBS, $CFLOWPERUNIT, $CFLOWUNITCACHEDIR, $CFLOWGRAPH, $CFLOWGRAPHSUFFIX,
+            $CFLOWCPPCACHE, $CFLOWCPPCACHEDIR
 
         Attach the TagsFile() builder to the environment.
     """
@@ -209,7 +542,18 @@ def generate(env, **kw):
                     '.c', '.y',
                     '','.c++', '.cc', '.cp', '.cpp', '.cxx', '.h', '.h++', '.hh', '.hp', '.hpp', '.hxx', '.C', '.H', '.tcc'
                 ],
-            CFLOWCPP            = [ ]
+            CFLOWCPP            = [ ],
+            CFLOWSINGLEPASS     = False,
+            CFLOWCALLSFLAGS     = [ '--all', '--all', '--brief', '--print-level' ],
+            CFLOWXREFFLAG       = [ '--xref' ],
+            CFLOWREVERSEFLAG    = [ '--reverse' ],
+            CFLOWJOBS           = 3,
+            CFLOWPERUNIT        = False,
+            CFLOWUNITCACHEDIR   = 'cflow.units',
+            CFLOWGRAPH          = False,
+            CFLOWGRAPHSUFFIX    = '.cgraph',
+            CFLOWCPPCACHE       = False,
+            CFLOWCPPCACHEDIR    = 'cflow.cpp'
         )
 
     env['BUILDERS']['CFlowTree'] = env.Builder\
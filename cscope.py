@@ -31,7 +31,6 @@ from __future__ import print_function
 import sys
 import os
 import re
-import subprocess
 import SCons.Script
 import source_browse_base as base
 
@@ -67,15 +66,24 @@ def collect_source_dependencies(target, source, env):
         if getString('CSCOPENAMEFILE') == default_namefile:
             env.SideEffect(default_namefile + '.8ebd1f37-538d-4d1b-a9f7-7fefa88581e4'. target)
 
+    if getBool('CSCOPEINCREMENTAL'):
+        target.append(str(target[0]) + getString('CSCOPESIGNATURESUFFIX'))
+
     keepVariantDir = getBool('CSCOPEKEEPVARIANTDIR')
 
-    return base.collect_source_dependencies(keepVariantDir, target, source, env, 'CSCOPESUFFIXES', True)
+    target, source = base.collect_source_dependencies(keepVariantDir, target, source, env, 'CSCOPESUFFIXES', True)
+
+    if getBool('CSCOPEINCREMENTAL'):
+        env.Precious(target)    # `cscope` updates the previous cross-reference for the modified sources
+
+    return target, source
 
 def run_cscope(target, source, env):
     """ action function invoked by the CScopeXRef() Builder to run `cscope` command """
 
     getList     = base.BindCallArguments(base.getList,     target, source, env, False)
     getPathList = base.BindCallArguments(base.getPathList, target, source, env, False)
+    getString   = base.BindCallArguments(base.getString,   target, source, env, None)
     getFile     = base.BindCallArguments(base.getString,   target, source, env, lambda x: x)
     getBool     = base.BindCallArguments(base.getBool,     target, source, env, None)
 
@@ -85,14 +93,13 @@ def run_cscope(target, source, env):
     namefile = None
 
     if 'CSCOPENAMEFILE' in env:
-        namefile = open(str(variant_dir.File(getFile('CSCOPENAMEFILE'))), 'w')
+        namefile = [ ]
 
         nameFileFlags = getList('CSCOPENAMEFILEFLAGS')
 
         for arg in env.Split(env.subst("$CSCOPEFLAGS", True, target, source, lambda x: x)):
             if arg in nameFileFlags:
-                namefile.write(arg)
-                namefile.write('\n')
+                namefile.append(arg + '\n')
 
     cscope_env = env['ENV']
 
@@ -131,43 +138,63 @@ def run_cscope(target, source, env):
                         inc_path.append(incdir)
 
         for incdir in  inc_path:
-            for arg in getList('CSCOPEINCFLAG'):
-                namefile.write(arg)
-                namefile.write(' ')
-
             if re.search('[\s"]', incdir) is not None:
                 incdir = '"' + incdir.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
-            namefile.write(incdir)
-            namefile.write('\n')
+            namefile.append(' '.join(getList('CSCOPEINCFLAG') + [ incdir ]) + '\n')
 
-    try:
-        command = env.Split(env.subst("$CSCOPECOM", True, target, source, lambda x: x))
+    command     = env.Split(env.subst("$CSCOPECOM", True, target, source, lambda x: x))
+    incremental = getBool('CSCOPEINCREMENTAL')
 
-        cscope_process = \
-            subprocess.Popen(command, stdin = subprocess.PIPE, env = cscope_env, cwd = str(cscope_dir))
+    file_list = [ ]
 
-        source.sort()
-        for file in source:
-            file_str = base.translate_relative_path(str(file), '.', str(cscope_dir))
+    for file in source:
+        file_str = base.translate_relative_path(str(file), '.', str(cscope_dir))
 
-            if re.search('[\s"]', file_str) is not None:
-                file_str = '"' + file_str.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        if re.search('[\s"]', file_str) is not None:
+            file_str = '"' + file_str.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
-            # print("Generating xrefs for source file " + file_str)
-            if namefile is not None:
-                namefile.write(file_str + '\n')
+        file_list.append(file_str)
 
-            cscope_process.stdin.write(file_str + '\n')
+    # keep the list in canonical order, so `cscope` can match the files in the previous cross-reference
+    file_list = sorted(set(file_list))
 
-        cscope_process.stdin.close()
+    if namefile is not None:
+        namefile      = ''.join(namefile + [ file_str + '\n' for file_str in file_list ])
+        namefile_name = str(variant_dir.File(getFile('CSCOPENAMEFILE')))
 
-        if cscope_process.wait():
-            sys.stderr.write("cscope command exited with code: " + str(cscope_process.returncode) + '\n')
-            return cscope_process.returncode
-    finally:
-        if namefile is not None:
-            namefile.close()
+        if not incremental or base.read_file(namefile_name) != namefile:
+            with open(namefile_name, 'w') as namefile_output:
+                namefile_output.write(namefile)
+
+    signature_file = str(target[0]) + getString('CSCOPESIGNATURESUFFIX')
+
+    if incremental:
+        # flags and include directories are saved with the cross-reference, other changes only need
+        # `cscope` to re-parse the modified sources
+        signature = \
+            '\n'.join\
+                (
+                    command + [ str(cscope_env.get(var, '')) for var in env_var_list + inc_var_list if var ]
+                ) \
+                    + '\n'
+
+        if base.read_file(signature_file) != signature or not os.path.exists(str(target[0])):
+            command += getList('CSCOPEUNCONDITIONALFLAG')
+
+            if os.path.exists(signature_file):
+                os.remove(signature_file)
+
+    result = base.run_command(command, file_list, cwd = str(cscope_dir), env = cscope_env)
+
+    print(result.timing_summary())
+
+    if result.returncode:
+        sys.stderr.write("cscope command exited with code: " + str(result.returncode) + '\n')
+        return result.returncode
+
+    if incremental:
+        base.write_file(signature_file, signature)
 
 def collect_source_directories(target, source, env):
     """ emitter function for CScopeDirXRef() builder, for listing source directories for xref file """
@@ -200,11 +227,58 @@ def collect_source_directories(target, source, env):
     # if env.Dir('.').srcnode() not in source:
     #     source = [ env.Dir('.').srcnode() ] + source
 
+    if getBool('CSCOPEDIRFINGERPRINT'):
+        target.append(str(target[0]) + getString('CSCOPEFINGERPRINTSUFFIX'))
+
     target = env.AlwaysBuild(target)
     source = source if getBool('CSCOPEKEEPVARIANTDIR') else  [ src.srcnode() for src in source ] 
 
+    if getBool('CSCOPEDIRFINGERPRINT'):
+        env.Precious(target)    # outputs are kept when the action finds the directories unchanged
+
     return target, source
 
+def source_dirs_fingerprint(target, source, env, cscope_dir, command, env_dirs):
+    """
+        Compute the fingerprint of the directory trees scanned by `cscope` for the CScopeDirXRef() builder:
+        the source directories (recursive with $CSCOPERECURSIVEFLAG) and the include directories, with the
+        command line and directory list variables as additional keys.
+    """
+    getList     = base.BindCallArguments(base.getList,     target, source, env, False)
+    getPathList = base.BindCallArguments(base.getPathList, target, source, env, False)
+    getBool     = base.BindCallArguments(base.getBool,     target, source, env, None)
+
+    cscope_path = cscope_dir.get_abspath()
+    recursive   = base.has_flags(getList('CSCOPEFLAGS'), getList('CSCOPERECURSIVEFLAG'))
+    suffixes    = getList('CSCOPESUFFIXES')
+
+    source_dirs = [ cscope_path ] + [ srcdir.get_abspath() for srcdir in source ]
+    include_dirs = \
+        base.translate_include_path\
+            (
+                env,
+                getPathList('CSCOPEPATH') + getPathList('CSCOPESYSPATH'),
+                target[0].cwd,
+                cscope_dir,
+                getBool('CSCOPEINCLUDEVARIANTDIR')
+            )
+
+    for dir_list in env_dirs:
+        if dir_list:
+            source_dirs += str(dir_list).split(os.pathsep)
+
+    include_fingerprint = \
+        base.directory_fingerprint([ os.path.join(cscope_path, incdir) for incdir in include_dirs ], suffixes, True)
+
+    return \
+        base.directory_fingerprint\
+            (
+                [ os.path.join(cscope_path, srcdir) for srcdir in source_dirs ],
+                suffixes,
+                recursive,
+                command + [ dir_list or '' for dir_list in env_dirs ] + [ include_fingerprint ]
+            )
+
 def run_cscope_on_dirs(target, source, env):
     """ action function invoked by the CScopeDirXRef() Builder to run `cscope` command """
 
@@ -272,6 +346,26 @@ def run_cscope_on_dirs(target, source, env):
                     )
             cscope_env[inc_var] = os.pathsep.join(inc_dirs)
 
+    fingerprint      = None
+    fingerprint_file = str(target[0]) + getString('CSCOPEFINGERPRINTSUFFIX')
+
+    if getBool('CSCOPEDIRFINGERPRINT'):
+        fingerprint = \
+            source_dirs_fingerprint\
+                (
+                    target, source, env, cscope_dir, command,
+                    [ cscope_env.get(var) for var in env_var_list + inc_var_list if var ]
+                )
+
+        if base.read_file(fingerprint_file) == fingerprint \
+                and \
+            all([ os.path.exists(str(node)) for node in target if str(node) != fingerprint_file ]):
+            print('cscope cross-reference ' + str(target[0]) + ' is up to date with the source directories')
+            return 0
+
+        if os.path.exists(fingerprint_file):
+            os.remove(fingerprint_file)
+
     default_namefile = str(cscope_dir.File(getFile('CSCOPEDEFAULTNAMEFILE')))
 
     if os.path.exists(default_namefile):
@@ -285,11 +379,66 @@ def run_cscope_on_dirs(target, source, env):
                 ' '.join(base.shell_escape(command)) + ')'
             )
 
-        return subprocess.Popen(command, env = cscope_env, cwd = str(cscope_dir)).wait()
+        result = base.run_command(command, cwd = str(cscope_dir), env = cscope_env)
+
+        print(result.timing_summary())
+
+        if result.returncode:
+            sys.stderr.write("cscope command exited with code: " + str(result.returncode) + '\n')
+            return result.returncode
+
+        if fingerprint is not None:
+            base.write_file(fingerprint_file, fingerprint)
     finally:
         if os.path.exists(default_namefile + '.8ebd1f37-538d-4d1b-a9f7-7fefa88581e4'):
             os.rename(default_namefile + '.8ebd1f37-538d-4d1b-a9f7-7fefa88581e4', default_namefile)
 
+def vim_escape(path):
+    """ escape a file name for a Vim ex command line """
+    return re.sub(r'([\s\\|"%#])', r'\\\1', path)
+
+def write_cscope_manifest(target, source, env):
+    """ action function invoked by the CScopeManifest() Builder to write a Vim script loading all the shards """
+
+    getFile = base.BindCallArguments(base.getString, target, source, env, lambda x: x)
+
+    with open(str(target[0]), 'w') as manifest:
+        manifest.write('" cscope cross-reference shards, load with :source ' + target[0].name + '\n')
+
+        for shard in source:
+            cscope_dir = shard.cwd.Dir(getFile('CSCOPEDIRECTORY'))
+
+            manifest.write\
+                (
+                    'silent! cscope add ' + vim_escape(shard.get_abspath()) + ' ' + vim_escape(cscope_dir.get_abspath()) + '\n'
+                )
+
+def CScopeShardedXRef(env, manifest, shards, **kw):
+    """
+        pseudo-builder (environment method) for one CScopeXRef() cross-reference per shard, and a Vim
+        script (the manifest) to load all of them with `cscope add`.
+
+        `shards` is a list of targets, with one shard for each target (like a library), or a dict
+        mapping shard names to lists of targets, for directory groups. Each shard is a separate SCons
+        target, so shards are built in parallel with `scons -j N`, and only the shards with changed
+        sources are rebuilt.
+    """
+
+    getString = base.BindCallArguments(base.getString, None, None, env, None)
+
+    shard_dir = env.Dir(kw.pop('shard_dir', getString('CSCOPESHARDDIR')))
+
+    if not isinstance(shards, dict):
+        shards = dict([ (re.sub(r'[^\w.+-]', '_', str(shard)), [ shard ]) for shard in env.Flatten([ shards ]) ])
+
+    shard_files = [ ]
+
+    for name in sorted(shards):
+        xref = env.CScopeXRef(shard_dir.File(name + getString('CSCOPESHARDSUFFIX')), env.Flatten([ shards[name] ]), **kw)
+        shard_files.append(xref[0])
+
+    return env.CScopeManifest(manifest, shard_files)
+
 def exists(env):
     """ Check if `cscope` command is present """
     return env['CSCOPE'] if 'CSCOPE' in env else None
@@ -303,9 +452,12 @@ def generate(env, **kw):
             $CSCOPE, $CSCOPEFILE, $CSCOPEFLAGS, $CSCOPEPATH, $CSCOPEINCFLAG,
             $CSCOPESUFFIXES, $CSCOPESTDINFLAGS, $CSCOPEOUTPUTFLAG,
             $CSCOPESOURCESUFFIXES, $CSCOPERECURSIVEFLAG, $CSCOPESOURCEDIRFLAG,
-            $CSCOPEDEFAULTNAMEFILE
+            $CSCOPEDEFAULTNAMEFILE, $CSCOPEDIRFINGERPRINT, $CSCOPEFINGERPRINTSUFFIX,
+            $CSCOPEINCREMENTAL, $CSCOPESIGNATURESUFFIX, $CSCOPEUNCONDITIONALFLAG,
+            $CSCOPESHARDDIR, $CSCOPESHARDSUFFIX, $CSCOPEMANIFESTCOMSTR
 
-        Attach the CScopeXRef() and CScopeDirXRef() builders to the environment.
+        Attach the CScopeXRef(), CScopeDirXRef(), CScopeManifest() and CScopeShardedXRef() builders to the
+        environment.
     """
 
     env.SetDefault\
@@ -359,6 +511,14 @@ def generate(env, **kw):
             CSCOPEDEFAULTNAMEFILE = 'cscope.files',
             CSCOPESOURCEDIRSENV   = [ 'SOURCEDIRS' ],
             CSCOPEINCLUDEDIRSENV  = [ 'INCLUDEDIRS' ],
+            CSCOPEDIRFINGERPRINT  = False,
+            CSCOPEFINGERPRINTSUFFIX = '.fingerprint',
+            CSCOPEINCREMENTAL     = False,
+            CSCOPESIGNATURESUFFIX = '.signature',
+            CSCOPEUNCONDITIONALFLAG = [ '-u' ],
+            CSCOPESHARDDIR        = 'cscope.shards',
+            CSCOPESHARDSUFFIX     = '.out',
+            CSCOPEMANIFESTCOMSTR  = 'Writing cscope manifest $TARGET',
             CSCOPELISTINCLUDES    =
                 lambda target, source, env, for_signature:
                     [
@@ -479,6 +639,15 @@ def generate(env, **kw):
                 source_factory  = SCons.Script.Dir
             )
 
+    env['BUILDERS']['CScopeManifest'] = env.Builder\
+            (
+                action  = SCons.Script.Action(write_cscope_manifest, '$CSCOPEMANIFESTCOMSTR'),
+                name    = 'CScopeManifest',
+                suffix  = '.vim'
+            )
+
+    env.AddMethod(CScopeShardedXRef, 'CScopeShardedXRef')
+
     # env.AddMethod(base.test_get_generated_list)
     env['XREF_GENERATED_LIST'] = \
             lambda generator, *generator_args: base.generated_list(generator, *generator_args)
@@ -0,0 +1,473 @@
+"""
+    Read-only query API for the cross-reference file generated by the CScopeXRef() builder, for use in scripts
+    and hooks, without running `cscope -d -L` for each query.
+
+    The cross-reference file is memory-mapped and scanned once, to build an inverted index from each symbol to
+    the places where it is defined, called or referenced, with the enclosing function. The index is saved in a
+    cache file next to the cross-reference (`cscope.out.pyidx` by default), that is memory-mapped by later
+    processes as long as the size and modification time of the cross-reference are unchanged. Each query then binary-searches the sorted
+    symbol table and unpacks only the postings for the symbol, without loading the whole index. The source
+    line text for a result is only decompressed when requested.
+
+    Index layout, with integers as unsigned little-endian values:
+        magic           8 bytes, 'XRCSCIDX'
+        header          32-bit version, symbol count S, file count F, posting count P, call count C,
+                        string table size B, then 64-bit cross-reference size and double modification time
+        string offsets  S + F + 1 32-bit offsets into the string table
+        string table    B bytes, the symbol names in sorted order followed by the file names
+        postings index  S + 1 32-bit offsets into the postings, for each symbol
+        postings        P records of 32-bit mark, file, line, enclosing function symbol (or 0xFFFFFFFF)
+                        and 64-bit offset of the source line in the cross-reference
+        calls index     S + 1 32-bit offsets into the calls, for each function
+        calls           C records as for the postings, with the called symbol instead of the function
+
+    Usage:
+        with CScopeReader('cscope.out') as xref:
+            for ref in xref.definitions('main'):
+                print(ref.file + ':' + str(ref.line) + ' ' + ref.text)
+
+            callers    = xref.callers('parse_args')
+            callees    = xref.callees('main')
+            references = xref.references('global_count')
+
+    The `.in` and `.po` inverted index files generated with `cscope -q` hold native machine integers and their
+    layout depends on the platform `cscope` was built for, so they are not read. The cache file takes their role.
+    Give `cache_file = None` to only keep the index in memory, or the name of another cache file.
+
+    The module can also be run as a script, with the query numbers from `cscope -L`:
+        python cscope_reader.py [-0 | -1 | -2 | -3] cscope.out symbol...
+    for references, definition, functions called by and functions calling the symbol.
+"""
+
+import sys
+import os
+import mmap
+import struct
+
+""" suffix appended to the cross-reference file name for the default index cache file """
+CACHE_SUFFIX  = '.pyidx'
+
+""" signature and version of the index file format """
+INDEX_MAGIC   = b'XRCSCIDX'
+INDEX_VERSION = 2
+
+""" index header after the signature, and the record for postings and calls """
+INDEX_HEADER  = struct.Struct('<6IQd')
+INDEX_RECORD  = struct.Struct('<4IQ')
+
+""" symbol index value for a reference outside any function """
+NO_FUNCTION   = 0xFFFFFFFF
+
+""" symbol marks in the cross-reference file """
+NEWFILE     = '@'
+FCNDEF      = '$'
+FCNEND      = '}'
+FCNCALL     = '`'
+DEFINE      = '#'
+DEFINEEND   = ')'
+INCLUDE     = '~'
+REFERENCE   = ''
+
+""" marks for symbol definitions: function, macro, class, enum, global, member, struct, typedef, union """
+definition_marks = set([ FCNDEF, DEFINE, 'c', 'e', 'g', 'm', 's', 't', 'u' ])
+
+""" character pairs for compressed text, a byte with the high bit set encodes dichar1[n / 8] + dichar2[n % 8] """
+dichar1 = b' teisaprnl(of)=c'
+dichar2 = b' tnerpla'
+
+""" keywords for compressed text, encoded as the byte value of the index, with a space appended if flagged """
+keywords = \
+    [
+        (b'', False), (b'#define', True), (b'#include', True), (b'break', False), (b'case', True),
+        (b'char', True), (b'continue', False), (b'default', False), (b'double', True), (b'\t', False),
+        (b'\n', False), (b'else', True), (b'enum', True), (b'extern', True), (b'float', True),
+        (b'for', True), (b'goto', True), (b'if', True), (b'int', True), (b'long', True),
+        (b'register', True), (b'return', False), (b'short', True), (b'sizeof', False), (b'static', True),
+        (b'struct', True), (b'switch', True), (b'typedef', True), (b'union', True), (b'unsigned', True),
+        (b'void', True), (b'while', True)
+    ]
+
+def expansion_table():
+    """ return the list with the expanded text for each byte value in compressed text """
+    table = [ bytes(bytearray([ byte ])) for byte in range(256) ]
+
+    for byte in range(1, len(keywords)):
+        if byte != 9 and byte != 10:
+            table[byte] = keywords[byte][0] + (b' ' if keywords[byte][1] else b'')
+
+    for byte in range(128, 256):
+        table[byte] = dichar1[(byte - 128) // 8:(byte - 128) // 8 + 1] + dichar2[(byte - 128) % 8:(byte - 128) % 8 + 1]
+
+    return table
+
+expanded_bytes = expansion_table()
+
+def decode(data):
+    """ translate bytes read from the cross-reference file to native str """
+    return data if str is bytes else data.decode('utf-8', 'surrogateescape')
+
+def encode(text):
+    """ translate a native str to the bytes found in the cross-reference file """
+    return text if isinstance(text, bytes) else text.encode('utf-8', 'surrogateescape')
+
+def is_symbol_start(byte):
+    return byte == b'_' or byte.isalpha()
+
+class Reference:
+    """ One occurrence of a symbol, with the file, line number and enclosing function (or None) """
+    def __init__(self, reader, symbol, mark, file, line, function, offset):
+        self.reader   = reader
+        self.symbol   = symbol
+        self.mark     = mark
+        self.file     = file
+        self.line     = line
+        self.function = function
+        self.offset   = offset
+
+    @property
+    def is_definition(self):
+        return self.mark in definition_marks
+
+    @property
+    def text(self):
+        """ source line text, decompressed from the cross-reference file """
+        return self.reader.line_text(self.offset)
+
+    def __repr__(self):
+        return 'Reference(' + ', '.join([ repr(x) for x in [ self.symbol, self.mark, self.file, self.line, self.function ] ]) + ')'
+
+class CScopeReader:
+    """ Memory-mapped cscope cross-reference file, with a memory-mapped inverted index of the symbols """
+    def __init__(self, file_name, cache_file = True):
+        self.file_name  = file_name
+        self.file       = open(file_name, 'rb')
+        stat            = os.fstat(self.file.fileno())
+        self.size       = stat.st_size
+        self.mtime      = stat.st_mtime
+        self.data       = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ) if self.size else b''
+        self.index_file = None
+
+        self.parse_header()
+
+        if cache_file is True:
+            cache_file = file_name + CACHE_SUFFIX
+
+        if not (cache_file and self.load_cache(cache_file)):
+            self.set_index(self.build_index())
+
+            if cache_file:
+                self.save_cache(cache_file)
+
+    def close(self):
+        if self.index_file:
+            self.index.close()
+            self.index_file.close()
+
+        if self.size:
+            self.data.close()
+
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def parse_header(self):
+        """ parse the first line: `cscope <version> <directory> [-c] [-q <symbol count>] [-T] <trailer offset>` """
+        self.header_end = self.data.find(b'\n')
+        fields          = self.data[:self.header_end].split()
+
+        if self.header_end < 0 or len(fields) < 4 or fields[0] != b'cscope':
+            raise ValueError(self.file_name + ': not a cscope cross-reference file')
+
+        self.version        = int(fields[1])
+        self.directory      = decode(fields[2])
+        self.compressed     = b'-c' not in fields
+        self.inverted       = b'-q' in fields
+        self.truncated      = b'-T' in fields
+        self.trailer_offset = int(fields[-1])
+
+    def line_end(self, position):
+        line_end = self.data.find(b'\n', position, self.trailer_offset)
+
+        return self.trailer_offset if line_end < 0 else line_end
+
+    def build_index(self):
+        """ scan all the cross-reference file, and return the index of the symbols in the index file format """
+        symbols   = { }
+        calls     = { }
+        files     = [ ]
+        file      = -1
+        function  = None
+        line      = 0
+        offset    = 0
+        position  = self.header_end + 1
+        end       = self.trailer_offset
+
+        while position < end:
+            line_end = self.line_end(position)
+            first    = self.data[position:position + 1]
+
+            if first == b'\t':
+                mark   = self.data[position + 1:position + 2]
+                symbol = self.data[position + 2:line_end]
+
+                if mark == b'@':
+                    if not symbol:
+                        break
+
+                    files.append(symbol)
+                    file, function, line = len(files) - 1, None, 0
+                elif mark == b'}':
+                    function = None
+                elif mark == b')':
+                    pass
+                else:
+                    if mark == b'~':
+                        symbol = symbol[1:]     # strip the '<' or '"' before the file name
+
+                    if mark == b'$':
+                        function = symbol
+
+                    symbols.setdefault(symbol, [ ]).append((ord(mark), file, line, function, offset))
+
+                    if mark == b'`' and function is not None:
+                        calls.setdefault(function, [ ]).append((ord(mark), file, line, symbol, offset))
+            elif first.isdigit():
+                digits = position
+
+                while self.data[digits:digits + 1].isdigit():
+                    digits += 1
+
+                line, offset = int(self.data[position:digits]), position
+            elif is_symbol_start(first):
+                symbols.setdefault(self.data[position:line_end], [ ]).append((0, file, line, function, offset))
+
+            position = line_end + 1
+
+        names      = sorted(set(symbols) | set(calls))
+        name_index = dict([ (name, index) for index, name in enumerate(names) ])
+
+        strings = names + files
+        offsets = [ 0 ]
+
+        for string in strings:
+            offsets.append(offsets[-1] + len(string))
+
+        blob = b''.join(strings)
+        blob += b'\0' * (-len(blob) % 4)
+
+        def records(table):
+            record_offsets, packed = [ 0 ], [ ]
+
+            for name in names:
+                for mark, file, line, symbol, offset in table.get(name, [ ]):
+                    packed.append(INDEX_RECORD.pack(mark, file, line, NO_FUNCTION if symbol is None else name_index[symbol], offset))
+
+                record_offsets.append(len(packed))
+
+            return record_offsets, b''.join(packed)
+
+        postings_offsets, postings = records(symbols)
+        calls_offsets,    calls    = records(calls)
+
+        def u32_array(values):
+            return struct.pack('<' + str(len(values)) + 'I', *values)
+
+        return b''.join\
+            ([
+                INDEX_MAGIC,
+                INDEX_HEADER.pack(INDEX_VERSION, len(names), len(files), postings_offsets[-1], calls_offsets[-1], len(blob), self.size, self.mtime),
+                u32_array(offsets),
+                blob,
+                u32_array(postings_offsets),
+                postings,
+                u32_array(calls_offsets),
+                calls
+            ])
+
+    def set_index(self, index):
+        """ use the index data, given as bytes or memory-mapped from the cache file, return False if out of date """
+        header_end = len(INDEX_MAGIC) + INDEX_HEADER.size
+
+        if len(index) < header_end or index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            return False
+
+        version, self.count, self.file_count, posting_count, call_count, string_size, size, mtime = \
+            INDEX_HEADER.unpack_from(index, len(INDEX_MAGIC))
+
+        if version != INDEX_VERSION or size != self.size or mtime != self.mtime:
+            return False
+
+        self.index            = index
+        self.string_offsets   = header_end
+        self.strings          = self.string_offsets + 4 * (self.count + self.file_count + 1)
+        self.postings_offsets = self.strings + string_size
+        self.postings_array   = self.postings_offsets + 4 * (self.count + 1)
+        self.calls_offsets    = self.postings_array + INDEX_RECORD.size * posting_count
+        self.calls_array      = self.calls_offsets + 4 * (self.count + 1)
+
+        return True
+
+    def load_cache(self, cache_file):
+        try:
+            index_file = open(cache_file, 'rb')
+        except (IOError, OSError):
+            return False
+
+        try:
+            index = mmap.mmap(index_file.fileno(), 0, access = mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            index_file.close()      # empty file
+            return False
+
+        if not self.set_index(index):
+            index.close()
+            index_file.close()
+            return False
+
+        self.index_file = index_file
+
+        return True
+
+    def save_cache(self, cache_file):
+        temp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+
+        try:
+            with open(temp_file, 'wb') as cache:
+                cache.write(self.index)
+
+            if os.name == 'nt' and os.path.exists(cache_file):
+                os.remove(cache_file)
+
+            os.rename(temp_file, cache_file)
+        except (IOError, OSError):
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def u32_array(self, section, start, end):
+        return struct.unpack_from('<' + str(end - start) + 'I', self.index, section + 4 * start)
+
+    def string(self, index):
+        start, end = self.u32_array(self.string_offsets, index, index + 2)
+
+        return self.index[self.strings + start:self.strings + end]
+
+    def symbol_index(self, symbol):
+        """ binary search for the index of the symbol, or None if not found """
+        key, low, high = encode(symbol), 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.string(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low if low < self.count and self.string(low) == key else None
+
+    def records(self, offsets, records, symbol):
+        """ return the (mark, file, line, symbol, offset) records for the symbol, from the postings or the calls """
+        index = self.symbol_index(symbol)
+
+        if index is None:
+            return [ ]
+
+        start, end = self.u32_array(offsets, index, index + 2)
+
+        return [ INDEX_RECORD.unpack_from(self.index, records + INDEX_RECORD.size * record) for record in range(start, end) ]
+
+    def line_text(self, offset):
+        """ return the decompressed source line starting at `offset` in the cross-reference file """
+        if not offset:
+            return ''
+
+        parts    = [ ]
+        position = offset
+
+        while position < self.trailer_offset:
+            line_end = self.line_end(position)
+            line     = self.data[position:line_end]
+
+            if position == offset:
+                line = line.lstrip(b'0123456789')[1:]       # line number and the space after it
+            elif not line:
+                break                                       # empty line ends the source line
+            elif line[:1] == b'\t':
+                line = line[2:]
+
+            parts.append(b''.join([ expanded_bytes[byte] for byte in bytearray(line) ]) if self.compressed else line)
+            position = line_end + 1
+
+        return decode(b''.join(parts))
+
+    def make_reference(self, symbol, mark, file, line, function, offset):
+        return \
+            Reference\
+                (
+                    self,
+                    symbol,
+                    chr(mark) if mark else REFERENCE,
+                    decode(self.string(self.count + file)),
+                    line,
+                    None if function == NO_FUNCTION else decode(self.string(function)),
+                    offset
+                )
+
+    def postings(self, symbol, marks = None):
+        return \
+            [
+                self.make_reference(symbol, *record)
+                    for record in self.records(self.postings_offsets, self.postings_array, symbol)
+                        if marks is None or (chr(record[0]) if record[0] else REFERENCE) in marks
+            ]
+
+    def references(self, symbol):
+        """ return all the references to the symbol, including definitions and calls """
+        return self.postings(symbol)
+
+    def definitions(self, symbol):
+        """ return the global definitions of the symbol """
+        return self.postings(symbol, definition_marks)
+
+    def callers(self, function):
+        """ return the calls to the given function, with the calling function as the `function` attribute """
+        return self.postings(function, [ FCNCALL ])
+
+    def callees(self, function):
+        """ return the calls made by the given function, with the called function as the `symbol` attribute """
+        return \
+            [
+                Reference(self, decode(self.string(callee)), FCNCALL, decode(self.string(self.count + file)), line, function, offset)
+                    for mark, file, line, callee, offset in self.records(self.calls_offsets, self.calls_array, function)
+            ]
+
+def main(argv):
+    queries = { '-0': 'references', '-1': 'definitions', '-2': 'callees', '-3': 'callers' }
+    query   = 'references'
+    args    = [ ]
+
+    for arg in argv:
+        if arg in queries:
+            query = queries[arg]
+        else:
+            args.append(arg)
+
+    if len(args) < 2:
+        sys.stderr.write('Syntax: ' + os.path.basename(sys.argv[0]) + ' [-0 | -1 | -2 | -3] cscope.out symbol...\n')
+        return 2
+
+    with CScopeReader(args[0]) as xref:
+        for symbol in args[1:]:
+            for ref in getattr(xref, query)(symbol):
+                name = ref.symbol if query == 'callees' else ref.function or '<global>'
+
+                print(' '.join([ ref.file, name, str(ref.line), ref.text ]))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
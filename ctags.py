@@ -24,6 +24,20 @@
     `ctags` tool should be used together with `gcc-dep`, to have full dependecy information (nested include
     files) generated by gcc / g++ compiler. Otherwise only the source dependencies visible to the SCons internal
     C/C++ scanner will be available to `ctags` command.
+
+    With $CTAGSSYSLAYER set, files under the $CTAGSSYSPREFIXES directories (system headers) are tagged into a
+    separate layer file, cached in $CTAGSSYSLAYERDIR and shared by all projects using the same toolchain and
+    headers. The project tags file only lists project sources, and a link to the layer is created next to it,
+    with the $CTAGSSYSLAYERSUFFIX extension ('tags.sys' by default), for editors to add to their tags list.
+    When no sources are found under the system directories, no layer is generated and the file is left empty.
+
+    With $CTAGSPARTIAL set, a partial tags file for the most relevant $CTAGSPARTIALCOUNT sources is published
+    first, while the complete tags file is still being generated.
+
+    The TagsIndex() builder keeps an SQLite symbol index ('tags.db') of the tags files, for queries by class
+    member, kind and directory, or by substring of symbol names, see module tags_index:
+        TagsIndex(TagsFile(...))
+        TagsIndex('tags.db', [ 'tags', 'tags.sys' ])
 """
 
 import sys
@@ -61,9 +75,192 @@ def collect_source_dependencies(target, source, env):
                 if os.path.exists(config):
                     env.Depends(tgt, config)
 
+    if getBool('CTAGSSYSLAYER'):
+        getString = base.BindCallArguments(base.getString, target, source, env, None)
+        target.append(env.File(target[0]).abspath + getString('CTAGSSYSLAYERSUFFIX'))
+
     keepVariantDir = getBool('CTAGSKEEPVARIANTDIR')
     return base.collect_source_dependencies(keepVariantDir, target, source, env, 'CTAGSSUFFIXES')
 
+def ctags_command(target, source, env, output_file = None):
+    """
+        Expand $CTAGSCOM for the given target and source. If `output_file` is given, it will replace
+        the translated target file name on the command line, so output goes to a different file.
+    """
+    command = env.Split(env.subst('$CTAGSCOM', True, target, source, lambda x: x))
+
+    if output_file is not None:
+        default_output = env.subst('$CTAGS_TRANSLATED_TARGET', True, target, source, lambda x: x)
+
+        for index in range(len(command) - 1, -1, -1):
+            if command[index] == default_output:
+                command[index] = output_file
+                break
+
+    return command
+
+def build_system_layer(target, source, env, ctags_dir):
+    """
+        Generate (or reuse) the tags file for system headers in `source`, in the cache directory given by
+        $CTAGSSYSLAYERDIR. The cached file name is a signature of the command line, $CTAGSSYSLAYERKEY and of the
+        exact set of header files (with their sizes and modification times), so the same file is shared by all
+        projects and runs using the same toolchain and headers. Return the absolute path of the layer file.
+    """
+    getPath = base.BindCallArguments(base.getPath, target, source, env, lambda x: x)
+
+    layer_dir  = os.path.abspath(getPath('CTAGSSYSLAYERDIR'))
+    file_names = sorted(set([ os.path.abspath(str(file)) for file in source ]))
+
+    ctags_bin  = env.Split(env.subst('$CTAGS_TRANSLATED_CMD', True, target, source, lambda x: x))[0]
+    bin_path   = env.WhereIs(ctags_bin)
+
+    signature = \
+        base.file_list_signature\
+            (
+                file_names,
+                [ os.path.realpath(bin_path) if bin_path else ctags_bin ]
+                    +
+                env.Split(env.subst('$CTAGSSYSLAYERKEY', True, target, source, lambda x: x))
+            )
+
+    layer_file = os.path.join(layer_dir, signature + '.tags')
+
+    if os.path.isfile(layer_file):
+        print("Using system tags layer " + layer_file)
+        return layer_file
+
+    if not os.path.isdir(layer_dir):
+        os.makedirs(layer_dir)
+
+    temp_file = layer_file + '.' + str(os.getpid()) + '.tmp'
+    command = ctags_command(target, source, env, temp_file)
+
+    print\
+        (
+            '(cd ' + ' '.join(base.shell_escape([ str(ctags_dir) ]))
+                   + ' && ' +
+            ' '.join(base.shell_escape(command)) + ')'
+        )
+
+    if base.run_command(command, file_names, cwd = str(ctags_dir), env = env['ENV']).returncode:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+        return None
+
+    base.replace_file(temp_file, layer_file)
+
+    return layer_file
+
+def priority_sources(target, source, env):
+    """
+        Order `source` for the partial tags file: use the $CTAGSPRIORITY hook if given, otherwise list files
+        from the project directory first, most recently modified first.
+    """
+    if 'CTAGSPRIORITY' in env and callable(env['CTAGSPRIORITY']):
+        return env['CTAGSPRIORITY'](target, source, env)
+
+    top_dir = [ env.Dir('#').srcnode().abspath ]
+
+    def priority_key(file):
+        file_name = os.path.abspath(str(file))
+
+        try:
+            mtime = os.path.getmtime(file_name)
+        except OSError:
+            mtime = 0
+
+        return not base.is_under_prefix(file_name, top_dir), -mtime
+
+    return sorted(source, key = priority_key)
+
+def start_ctags(command, source, env, ctags_dir):
+    """
+        start a thread running `ctags` command with the list of source files, and return it. The CommandResult
+        is available as the `result` attribute after the thread completes.
+    """
+
+    print\
+        (
+            '(cd ' + ' '.join(base.shell_escape([ str(ctags_dir) ]))
+                   + ' && ' +
+            ' '.join(base.shell_escape(command)) + ')'
+        )
+
+    def run_ctags_thread():
+        ctags_thread.result = \
+            base.run_command\
+                (
+                    command,
+                    [ base.translate_relative_path(str(file), '.', str(ctags_dir)) for file in source ],
+                    cwd = str(ctags_dir),
+                    env = env['ENV']
+                )
+
+    ctags_thread = threading.Thread(target = run_ctags_thread)
+    ctags_thread.result = None
+    ctags_thread.start()
+
+    return ctags_thread
+
+def run_ctags_two_phase(target, source, env, ctags_dir):
+    """
+        Generate tags in two phases: the first $CTAGSPARTIALCOUNT files from priority_sources() are tagged into
+        a partial tags file, published (atomically renamed) over the target tags file as soon as it is ready.
+        The complete tags file is generated at the same time in a temporary file, and replaces the partial one
+        when complete.
+    """
+    getString = base.BindCallArguments(base.getString, target, source, env, None)
+
+    tags_file    = target[0].get_abspath()
+    temp_suffix  = '.' + str(os.getpid()) + '.tmp'
+    partial_file = tags_file + '.partial' + temp_suffix
+    full_file    = tags_file + temp_suffix
+
+    partial_source = priority_sources(target, source, env)[:int(getString('CTAGSPARTIALCOUNT'))]
+
+    partial_thread = start_ctags(ctags_command(target, source, env, partial_file), partial_source, env, ctags_dir)
+    full_thread    = start_ctags(ctags_command(target, source, env, full_file),    source,         env, ctags_dir)
+
+    published = False
+
+    try:
+        partial_thread.join()
+
+        if partial_thread.result is not None:
+            print('partial tags ' + partial_thread.result.timing_summary())
+
+        if partial_thread.result is not None and not partial_thread.result.returncode and full_thread.is_alive():
+            base.replace_file(partial_file, tags_file)
+            published = True
+            print("Partial tags file published with " + str(len(partial_source)) + " files: " + str(target[0]))
+
+        full_thread.join()
+
+        if full_thread.result is not None:
+            print('complete tags ' + full_thread.result.timing_summary())
+
+        if full_thread.result is None or full_thread.result.returncode:
+            if published and os.path.exists(tags_file):
+                # do not leave the partial tags file as the build result
+                os.remove(tags_file)
+
+            if full_thread.result is None:
+                return 1
+
+            sys.stderr.write("ctags command exited with code: " + str(full_thread.result.returncode) + '\n')
+            return full_thread.result.returncode
+
+        base.replace_file(full_file, tags_file)
+    finally:
+        # both `ctags` commands are complete before the temporary files are removed, even on errors
+        partial_thread.join()
+        full_thread.join()
+
+        for temp_file in [ partial_file, full_file ]:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
 def run_ctags(target, source, env):
     """ action function invoked by the TagsFile() Builder to run `ctags` command """
 
@@ -76,22 +273,58 @@ def run_ctags(target, source, env):
     variant_dir = target[0].cwd
     ctags_dir  = variant_dir.Dir(getFile('CTAGSDIRECTORY'))
 
-    command = env.Split(env.subst('$CTAGSCOM', True, target, source, lambda x: x))
+    if getBool('CTAGSSYSLAYER'):
+        system_source, source = base.partition_by_prefix(source, getList('CTAGSSYSPREFIXES'))
+
+        if system_source:
+            layer_file = build_system_layer(target, system_source, env, ctags_dir)
+
+            if layer_file is None:
+                sys.stderr.write("ctags command failed to generate the system tags layer\n")
+                return 1
+
+            base.link_file(layer_file, target[1].get_abspath())
+        else:
+            # no system headers, so no layer to generate, only an empty file for the declared target
+            if os.path.lexists(target[1].get_abspath()):
+                os.remove(target[1].get_abspath())
+
+            open(target[1].get_abspath(), 'w').close()
+
+    if getBool('CTAGSPARTIAL'):
+        return run_ctags_two_phase(target, source, env, ctags_dir)
 
-    ctags_process = \
-        subprocess.Popen(command, stdin = subprocess.PIPE, cwd = str(ctags_dir), env = env['ENV'])
+    command = ctags_command(target, source, env)
 
-    # source.sort()
-    for file in source:
-        # print("Generating tags for source file " + str(file))
-        file_str = base.translate_relative_path(str(file), '.', str(ctags_dir))
-        ctags_process.stdin.write(file_str + "\n")
+    result = \
+        base.run_command\
+            (
+                command,
+                (base.translate_relative_path(str(file), '.', str(ctags_dir)) for file in source),
+                cwd = str(ctags_dir),
+                env = env['ENV']
+            )
+
+    print(result.timing_summary())
+
+    if result.returncode:
+        sys.stderr.write("ctags command exited with code: " + str(result.returncode) + '\n')
+        return result.returncode
+
+def tags_index_emitter(target, source, env):
+    """ keep the database between builds, so the TagsIndex() builder can update it incrementally """
+    env.Precious(target)
 
-    ctags_process.stdin.close()
+    return target, source
 
-    if ctags_process.wait():
-        sys.stderr.write("ctags command exited with code: " + str(ctags_process.returncode) + '\n')
-        return ctags_process.returncode
+def run_tags_index(target, source, env):
+    """ action function invoked by the TagsIndex() Builder to update the SQLite symbol index """
+    import tags_index
+
+    with tags_index.TagsIndex(target[0].get_abspath()) as index:
+        changed, removed = index.update([ file.get_abspath() for file in source ])
+
+    print('Tags index updated for ' + str(changed) + ' changed and ' + str(removed) + ' removed files')
 
 def exists(env):
     """ Check if `ctags` command is present """
@@ -144,9 +377,11 @@ def generate(env, **kw):
     """
         Populate environment with variables for the TagsFile() builder:
             $CTAGS, $CTAGSFILE, $CTAGSFLAGS, $CTAGSDEF, $CTAGSDEFPREFIX,
-            $CTAGSCONFIG, $CTAGSSUFFIXES, $CTAGSSTDINFLAGS, $CTAGSOUTPUTFLAG
+            $CTAGSCONFIG, $CTAGSSUFFIXES, $CTAGSSTDINFLAGS, $CTAGSOUTPUTFLAG,
+            $CTAGSSYSLAYER, $CTAGSSYSLAYERSUFFIX, $CTAGSSYSLAYERDIR, $CTAGSSYSLAYERKEY, $CTAGSSYSPREFIXES,
+            $CTAGSPARTIAL, $CTAGSPARTIALCOUNT, $CTAGSPRIORITY, $CTAGSINDEXSUFFIX, $CTAGSINDEXCOMSTR
 
-        Attach the TagsFile() builder to the environment.
+        Attach the TagsFile() and TagsIndex() builders to the environment.
     """
 
     env.SetDefault\
@@ -225,6 +460,15 @@ def generate(env, **kw):
                     '.y'
                 ],
             CTAGSKEEPVARIANTDIR = False,
+            CTAGSPARTIAL        = False,
+            CTAGSPARTIALCOUNT   = 2000,
+            CTAGSSYSLAYER       = False,
+            CTAGSSYSLAYERSUFFIX = '.sys',
+            CTAGSSYSLAYERDIR    = os.path.join(os.environ['HOME'], '.cache', 'xref-tag', 'ctags'),
+            CTAGSSYSLAYERKEY    = [ '$CTAGSFLAGS', '$CTAGS_DEF_ARGS' ],
+            CTAGSSYSPREFIXES    = [ '/usr/include', '/usr/local/include', '/usr/lib/gcc', '/usr/lib/clang' ],
+            CTAGSINDEXSUFFIX    = '.db',
+            CTAGSINDEXCOMSTR    = 'Updating tags index $TARGET',
             CTAGS_TRANSLATED_CMD =
                 lambda target, source, env, for_signature:
                     [
@@ -287,3 +531,11 @@ def generate(env, **kw):
                 suffix  = '4f9807f6-fcb3-47ff-ac8e-e3a0e2e2c478',
                 # source_scanner = SCons.Script.CScan
             )
+
+    env['BUILDERS']['TagsIndex'] = env.Builder\
+            (
+                emitter = tags_index_emitter,
+                action  = SCons.Script.Action(run_tags_index, '$CTAGSINDEXCOMSTR'),
+                name    = 'TagsIndex',
+                suffix  = '$CTAGSINDEXSUFFIX'
+            )
@@ -24,8 +24,11 @@
 
 import sys
 import os
+import re
+import time
+import json
+import shutil
 import tempfile
-import subprocess
 import SCons.Script
 import source_browse_base as base
 
@@ -56,13 +59,276 @@ def collect_source_dependencies(target, source, env):
                 if os.path.exists(config):
                     env.Depends(tgt, config)
 
+    if getBool('GTAGSLIBLAYER') or int(env['GTAGSJOBS']) > 1:
+        target += [ target[0].dir.File(env['GTAGSLIBPATHFILE']), target[0].dir.File(env['GTAGSDRIVER']) ]
+
+    if int(env['GTAGSJOBS']) > 1:
+        env.Clean(target, target[0].dir.Dir(env['GTAGSSHARDDIR']))
+
+    if env.get('GTAGSFILELIST'):
+        env.Clean(target, target[0].dir.File(env['GTAGSFILELIST']))
+
+    if env.get('GTAGSSTATSFILE'):
+        target.append(target[0].dir.File(env['GTAGSSTATSFILE']))
+
+    if env.get('GTAGSSTATSHISTORY'):
+        target.append(target[0].dir.File(env['GTAGSSTATSHISTORY']))
+        env.Precious(target[-1])    # records are appended to the history from previous runs
+
+    if getBool('GTAGSINCREMENTAL'):
+        target.append(target[0].dir.File(env['GTAGSSTATEFILE']))
+        env.Precious(target)    # `gtags` updates the previous tag files
+
     keepVariantDir = getBool('GTAGSKEEPVARIANTDIR')
 
     return base.collect_source_dependencies(keepVariantDir, target, source, env, 'GTAGSSUFFIXES')
 
+def print_command(command, work_dir, target, source, env):
+    if 'GTAGSCOMSTR' in env and env['GTAGSCOMSTR'] is not None:
+        print(env.subst("$GTAGSCOMSTR", True, target, source))
+    else:
+        # print("Targets: " + str([ str(tgt) for tgt in target ]))
+        if work_dir is not None:
+            print(' '.join([ '(' ] + base.shell_escape([ 'cd', work_dir ]) + [ '&&' ] + base.shell_escape(command) + [ ')' ]))
+        else:
+            print(' '.join(base.shell_escape(command)))
+
+def gtags_signature(work_dir, target, source, env):
+    """ signature of the `gtags` command line, configuration and environment, that require a full rebuild when changed """
+    keys = \
+        env.Split(env['GTAGS']) + env.Split(env['GTAGSFLAGS']) \
+            + \
+        [ str(work_dir), str(sorted(env.get('GTAGSADDENV', { }).items())) ]
+
+    if 'GTAGSCONFIG' in env:
+        keys += env['GTAGSCONFIG']
+    else:
+        keys += [ base.read_file(config, '') for config in env.Split(env.get('GTAGSCONFIGLIST', [ ])) ]
+
+    return base.file_list_signature([ ], keys)
+
+def file_state(file_list):
+    """ map each file in the list to its size and modification time """
+    state = { }
+
+    for file_name in file_list:
+        try:
+            stat = os.stat(file_name)
+            state[file_name] = [ stat.st_size, repr(stat.st_mtime) ]
+        except OSError:
+            state[file_name] = None
+
+    return state
+
+def read_state(state_file):
+    try:
+        return json.loads(base.read_file(state_file, ''))
+    except ValueError:
+        return { }
+
+def build_lib_layer(lib_source, config_args, cmd_env, target, source, env):
+    """
+        Generate (or reuse) the GLOBAL database for the library files in `lib_source`, in a subdirectory of
+        $GTAGSLIBLAYERDIR named after a signature of the `gtags` executable, flags, configuration, $GTAGSLIBLAYERKEY
+        and of the exact set of library files (with their sizes and modification times), so the same database
+        is shared by all projects and runs using the same toolchain and SDKs. Return the layer directory.
+    """
+    layer_root = os.path.abspath(env.subst('$GTAGSLIBLAYERDIR', True, target, source))
+    file_names = sorted(set([ os.path.abspath(str(file)) for file in lib_source ]))
+
+    gtags_bin  = env.Split(env['GTAGS'])[0]
+    bin_path   = env.WhereIs(gtags_bin)
+
+    signature = \
+        base.file_list_signature\
+            (
+                file_names,
+                [ os.path.realpath(bin_path) if bin_path else gtags_bin, gtags_signature('/', target, source, env) ]
+                    +
+                env.Split(env.subst('$GTAGSLIBLAYERKEY', True, target, source))
+            )
+
+    layer_dir = os.path.join(layer_root, signature)
+
+    if os.path.isfile(os.path.join(layer_dir, 'GTAGS')):
+        print("Using library tags layer " + layer_dir)
+        return layer_dir
+
+    temp_dir = layer_dir + '.' + str(os.getpid()) + '.tmp'
+
+    if not os.path.isdir(temp_dir):
+        os.makedirs(temp_dir)
+
+    command = \
+        env.Split(env['GTAGS']) + env.Split(env['GTAGSFLAGS']) + env.Split(env['GTAGSSTDINFLAGS']) + config_args \
+            + \
+        env.Split(env['GTAGSOUTPUTFLAG']) + [ temp_dir ]
+
+    print_command(command, '/', target, source, env)
+
+    if base.run_command(command, file_names, cwd = '/', env = cmd_env).returncode:
+        shutil.rmtree(temp_dir, True)
+        return None
+
+    try:
+        os.rename(temp_dir, layer_dir)
+    except OSError:
+        # layer generated at the same time by another build
+        shutil.rmtree(temp_dir, True)
+
+        if not os.path.isdir(layer_dir):
+            raise
+
+    return layer_dir
+
+def file_list_command(command, output_args, list_file, file_list, env):
+    """
+        Return the `gtags` command line and standard input lines for indexing the files in `file_list`. With a
+        `list_file` name the list is given with $GTAGSFILELISTFLAG, and the file is only written when the list
+        changes, otherwise the list is given on standard input.
+    """
+    if not list_file:
+        return command + env.Split(env['GTAGSSTDINFLAGS']) + output_args, file_list
+
+    content = ''.join([ file_name + '\n' for file_name in file_list ])
+
+    if base.read_file(list_file) != content:
+        base.write_file(list_file, content)
+
+    return command + env.Split(env['GTAGSFILELISTFLAG']) + [ os.path.abspath(list_file) ] + output_args, None
+
+statistics_row_re      = re.compile(r'^\s*(\S.*?)\s+(\d+\.\d+)\s+(\d+\.\d+)\s+(\d+\.\d+)\s+(\d+(?:\.\d+)?)\s*$')
+statistics_count_re    = re.compile(r'^\s*(?:total\s+(?:of\s+)?)?(\d+)\s+(tag|file)s?\b', re.IGNORECASE)
+statistics_progress_re = re.compile(r'^\s*\[\d+(?:/\d+)?\]\s+(extracting|deleting)\s+tags\s+of\b')
+
+def parse_statistics(output):
+    """
+        Parse the output of `gtags --statistics` into a list of per-phase records from the time table, and a
+        dictionary with the tag and file counts: 'tags' and 'files' from the count lines like `123 tags`, and
+        'extracting' and 'deleting' for the number of files in the progress lines output with `--verbose`.
+    """
+    phases = [ ]
+    counts = { }
+
+    for line in output.decode('utf-8', 'replace').splitlines():
+        match    = statistics_row_re.match(line)
+        count    = statistics_count_re.match(line)
+        progress = statistics_progress_re.match(line)
+
+        if count:
+            key         = count.group(2).lower() + 's'
+            counts[key] = counts.get(key, 0) + int(count.group(1))
+        elif progress:
+            counts[progress.group(1)] = counts.get(progress.group(1), 0) + 1
+        elif match:
+            phases.append\
+                (
+                    {
+                        'phase':    match.group(1),
+                        'user':     float(match.group(2)),
+                        'system':   float(match.group(3)),
+                        'elapsed':  float(match.group(4)),
+                        'cpu':      float(match.group(5))
+                    }
+                )
+
+    return phases, counts
+
+def source_breakdown(file_list):
+    """
+        Return the file count and size of the sources for each top directory: first level subdirectories of
+        the project directory, or the first two levels of the absolute path for files outside the project.
+    """
+    directories = { }
+
+    for file_name in file_list:
+        try:
+            size = os.path.getsize(file_name)
+        except OSError:
+            size = 0
+
+        path = os.path.relpath(file_name).split(os.sep)
+
+        if path[0] == os.pardir:
+            top_dir = os.sep.join(os.path.abspath(file_name).split(os.sep)[:3])
+        else:
+            top_dir = path[0] if len(path) > 1 else os.curdir
+
+        directory = directories.setdefault(top_dir, { 'files': 0, 'bytes': 0 })
+        directory['files'] += 1
+        directory['bytes'] += size
+
+    return directories
+
+def statistics_record(results, file_list, db_dirs, mode, env):
+    """ build the metrics record for one GTAGS() build, from the results of the `gtags` commands """
+    directories = source_breakdown(file_list)
+    outputs     = { }
+    statistics  = [ parse_statistics(result.stdout + result.stderr) for result in results ]
+
+    for db_dir in db_dirs:
+        for output in [ 'GTAGS', 'GRTAGS', 'GPATH' ]:
+            output_file = os.path.join(db_dir, output)
+
+            if os.path.exists(output_file):
+                outputs[output_file] = os.path.getsize(output_file)
+
+    return \
+        {
+            'time':         time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(results[0].start_time if results else time.time())),
+            'mode':         mode,
+            'jobs':         len(results),
+            'files':        len(file_list),
+            'bytes':        sum([ directory['bytes'] for directory in directories.values() ]),
+            'elapsed':      max([ result.end_time for result in results ]) - min([ result.start_time for result in results ]) if results else 0.0,
+            'tags':         sum([ counts.get('tags', 0) for phases, counts in statistics ]),
+            'directories':  directories,
+            'outputs':      outputs,
+            'commands':
+                [
+                    {
+                        'elapsed':      result.elapsed(),
+                        'input_count':  result.input_count,
+                        'phases':       phases,
+                        'counts':       counts
+                    }
+                        for result, (phases, counts) in zip(results, statistics)
+                ]
+        }
+
+def write_statistics(db_dir, record, env):
+    """
+        write the metrics record in $GTAGSSTATSFILE, and append it to $GTAGSSTATSHISTORY, keeping only the last
+        $GTAGSSTATSHISTORYMAX records
+    """
+    if env.get('GTAGSSTATSFILE'):
+        base.write_file(os.path.join(db_dir, env['GTAGSSTATSFILE']), json.dumps(record, indent = 4, sort_keys = True) + '\n')
+
+    if env.get('GTAGSSTATSHISTORY'):
+        history_file = os.path.join(db_dir, env['GTAGSSTATSHISTORY'])
+        history      = base.read_file(history_file, '').splitlines(True) + [ json.dumps(record, sort_keys = True) + '\n' ]
+
+        base.write_file(history_file, ''.join(history[-max(int(env['GTAGSSTATSHISTORYMAX']), 1):]))
+
+def write_global_driver(driver_file, lib_path, env):
+    """ write a shell script running `global` on the project database, and through all the shards and layers """
+    base.write_file\
+        (
+            driver_file,
+            '#!/bin/sh\n'
+                +
+            ('GTAGSLIBPATH=' + base.shell_escape([ os.pathsep.join(lib_path) ])[0] + '${GTAGSLIBPATH:+:$GTAGSLIBPATH} ' if lib_path else '')
+                +
+            'exec ' + ' '.join(base.shell_escape(env.Split(env['GTAGSGLOBAL']) + env.Split(env['GTAGSTHROUGHFLAG']))) + ' "$@"\n'
+        )
+
+    os.chmod(driver_file, 0o755)
+
 def run_gtags(target, source, env):
     """ action function invoked by the GTAGS() Builder to run `gtags` command """
 
+    getBool = base.BindCallArguments(base.getBool, target, source, env, None)
+
     temp_config    = None
     work_dir       = None
     cmd_env        = env['ENV']
@@ -74,56 +340,174 @@ def run_gtags(target, source, env):
             gtagsroot_file = os.path.join(str(target[0].dir), k)
             break
 
-    command = \
-            env.Split(env['GTAGS']) \
-                + \
-            env.Split(env['GTAGSFLAGS']) \
-                + \
-            env.Split(env['GTAGSSTDINFLAGS'])
+    lib_source = [ ]
+
+    if getBool('GTAGSLIBLAYER'):
+        lib_source, source = base.partition_by_prefix(source, env.Split(env['GTAGSLIBPREFIXES']))
+
+    file_list   = [ str(file) for file in source ]
+
+    if work_dir is not None:
+        file_list = base.absolute_paths(file_list)
+
+    jobs = int(env['GTAGSJOBS'])
+
+    # the shards are always generated again, no incremental update is used with $GTAGSJOBS
+    incremental = getBool('GTAGSINCREMENTAL') and jobs <= 1
+    state_file  = os.path.join(str(target[0].dir), env['GTAGSSTATEFILE'])
+    changed     = None
+
+    if incremental:
+        signature = gtags_signature(work_dir, target, source, env)
+        state     = read_state(state_file)
+        files     = file_state(file_list)
+
+        if state.get('signature') == signature and all([ os.path.exists(str(tgt)) for tgt in target if str(tgt) != state_file ]):
+            old_files = state.get('files', { })
+            removed   = [ file for file in old_files if file not in files ]
+
+            # `gtags` only drops the tags for files deleted from disk, not for files removed from the source list
+            if not [ file for file in removed if os.path.exists(file) ]:
+                changed  = [ file for file in file_list if file not in old_files or old_files[file] != files[file] ]
+                changed += removed
+
+    if os.path.exists(state_file):
+        # a sharded run replaces the database in dbpath with the first shard
+        os.remove(state_file)
+
+    command = env.Split(env['GTAGS']) + env.Split(env['GTAGSFLAGS'])
+
+    if changed is not None and len(changed) > int(env['GTAGSSINGLEUPDATEMAX']):
+        command += env.Split(env['GTAGSINCREMENTALFLAG'])
 
     if 'GTAGSCONFIG' in env:
-        temp_config  = tempfile.NamedTemporaryFile(delete = False)
+        temp_config  = tempfile.NamedTemporaryFile(mode = 'w', delete = False)
 
     try:
+        config_args = [ ]
+
         if temp_config is not None:
             for config_line in env['GTAGSCONFIG']:
                 temp_config.write(config_line + '\n')
             temp_config.close()
 
-            command += env.Split(env['GTAGSCONFIGFLAG']) + [ temp_config.name ]
+            config_args = env.Split(env['GTAGSCONFIGFLAG']) + [ temp_config.name ]
+            command    += config_args
 
-        command += \
+        output_args = \
                 env.Split(env['GTAGSOUTPUTFLAG']) \
                     + \
                 [ str(target[0].dir) if work_dir is None else os.path.abspath(str(target[0].dir)) ]
 
-        if 'GTAGSCOMSTR' in env and env['GTAGSCOMSTR'] is not None:
-            print(env.subst("$GTAGSCOMSTR", True, target, source))
-        else:
-            # print("Targets: " + str([ str(tgt) for tgt in target ]))
-            if work_dir is not None:
-                print(' '.join([ '(' ] + base.shell_escape([ 'cd', work_dir ]) + [ '&&' ] + base.shell_escape(command) + [ ')' ]))
-            else:
-                print(' '.join(base.shell_escape(command)))
-
         if 'GTAGSADDENV' in env:
             for k in  env['GTAGSADDENV']:
                 cmd_env[k] = env['GTAGSADDENV'][k]
 
             # print("Environ: " + str(cmd_env))
 
-        gtags_process = subprocess.Popen(command, stdin = subprocess.PIPE, cwd = work_dir, env = cmd_env)
+        lib_path   = [ ]
+        shard_dirs = [ ]
+        list_file  = os.path.join(str(target[0].dir), env['GTAGSFILELIST']) if env.get('GTAGSFILELIST') else None
+
+        if getBool('GTAGSLIBLAYER'):
+            layer_dir = build_lib_layer(lib_source, config_args, cmd_env, target, source, env)
+
+            if layer_dir is None:
+                sys.stderr.write("gtags command failed to generate the library tags layer\n")
+                return 1
+
+            lib_path.append(layer_dir)
+
+        shard_root = os.path.join(str(target[0].dir), env['GTAGSSHARDDIR'])
+
+        if os.path.exists(shard_root):
+            # the lib path file and the driver script from the previous run still list the stale shards
+            shutil.rmtree(shard_root, True)
 
-        # source.sort()
-        for file in source:
-            # print("Generating tags for source file " + (str(file) if work_dir is None else os.path.abspath(str(file))))
-            gtags_process.stdin.write((str(file) if work_dir is None else os.path.abspath(str(file))) + "\n")
+            for file_var in [ 'GTAGSLIBPATHFILE', 'GTAGSDRIVER' ]:
+                stale_file = os.path.join(str(target[0].dir), env[file_var])
 
-        gtags_process.stdin.close()
+                if os.path.exists(stale_file):
+                    os.remove(stale_file)
 
-        if gtags_process.wait():
-            sys.stderr.write("gtags command exited with code: " + str(gtags_process.returncode) + '\n')
-            return gtags_process.returncode
+        if jobs > 1:
+            # first shard goes in dbpath, the others are chained with GTAGSLIBPATH
+            shards     = base.group_by_directory(file_list, jobs)
+            commands   = [ file_list_command(command, output_args, list_file, shards[0], env) ]
+
+            shard_dirs = [ os.path.abspath(os.path.join(shard_root, str(index))) for index in range(1, len(shards)) ]
+
+            for shard_dir, shard_files in zip(shard_dirs, shards[1:]):
+                os.makedirs(shard_dir)
+                commands.append\
+                    (
+                        file_list_command
+                            (
+                                command,
+                                env.Split(env['GTAGSOUTPUTFLAG']) + [ shard_dir ],
+                                list_file and os.path.join(shard_dir, env['GTAGSFILELIST']),
+                                shard_files,
+                                env
+                            )
+                    )
+
+            lib_path = shard_dirs + lib_path
+        elif changed is None or len(changed) > int(env['GTAGSSINGLEUPDATEMAX']):
+            commands = [ file_list_command(command, output_args, list_file, file_list, env) ]
+        else:
+            # `gtags --single-update` also removes the tags for a deleted file
+            commands = \
+                [
+                    (command + env.Split(env['GTAGSSINGLEUPDATEFLAG']) + [ file ] + output_args, None)
+                        for file in sorted(changed)
+                ]
+
+        def run_gtags_command(args):
+            print_command(args[0], work_dir, target, source, env)
+
+            # the output is only kept for the statistics, and is shown while `gtags` runs
+            result = base.run_command(args[0], args[1], cwd = work_dir, env = cmd_env, capture_stdout = statistics, echo_stdout = True)
+            print(result.timing_summary())
+
+            return result
+
+        statistics = bool(env.get('GTAGSSTATSFILE') or env.get('GTAGSSTATSHISTORY'))
+        results    = base.run_parallel(run_gtags_command, commands, jobs)
+
+        for result in results:
+            if result.returncode:
+                sys.stderr.write("gtags command exited with code: " + str(result.returncode) + '\n')
+                return result.returncode
+
+        if statistics:
+            if jobs > 1:
+                mode = 'sharded'
+            elif changed is None:
+                mode = 'full'
+            elif len(changed) > int(env['GTAGSSINGLEUPDATEMAX']):
+                mode = 'incremental'
+            else:
+                mode = 'single-update'
+
+            record = \
+                statistics_record\
+                    (
+                        results,
+                        file_list if changed is None or jobs > 1 else changed,
+                        [ str(target[0].dir) ] + shard_dirs,
+                        mode,
+                        env
+                    )
+
+            write_statistics(str(target[0].dir), record, env)
+
+        if getBool('GTAGSLIBLAYER') or jobs > 1:
+            # `global` searches the shards and layers listed in the GTAGSLIBPATH environment variable, the
+            # files are also written for a single shard, as they are always declared as targets
+            lib_path_file = os.path.join(str(target[0].dir), env['GTAGSLIBPATHFILE'])
+
+            base.write_file(lib_path_file, os.pathsep.join(lib_path) + '\n' if lib_path else '')
+            write_global_driver(os.path.join(str(target[0].dir), env['GTAGSDRIVER']), lib_path, env)
 
         if gtagsroot_file is not None:
             root_file = open(gtagsroot_file, 'w')
@@ -131,6 +515,9 @@ def run_gtags(target, source, env):
                 root_file.write(work_dir + '\n')
             finally:
                 root_file.close()
+
+        if incremental:
+            base.write_file(state_file, json.dumps({ 'signature': signature, 'files': files }))
     finally:
         if temp_config is not None:
             # os.remove(temp_config.name)
@@ -147,7 +534,11 @@ def generate(env, **kw):
     """
         Populate environment with variables for the GTAGS() builder:
             $GTAGS, $GTAGSDBPATH, $GTAGSFLAGS, $GTAGSSTDFLAGS, $GTAGSOUTPUTFLAG,
-            $GTAGSSUFFIXES
+            $GTAGSSUFFIXES, $GTAGSINCREMENTAL, $GTAGSINCREMENTALFLAG, $GTAGSSINGLEUPDATEFLAG,
+            $GTAGSSINGLEUPDATEMAX, $GTAGSSTATEFILE, $GTAGSLIBLAYER, $GTAGSLIBPREFIXES, $GTAGSLIBLAYERDIR,
+            $GTAGSLIBLAYERKEY, $GTAGSLIBPATHFILE, $GTAGSJOBS, $GTAGSSHARDDIR, $GTAGSDRIVER, $GTAGSGLOBAL,
+            $GTAGSTHROUGHFLAG, $GTAGSFILELIST, $GTAGSFILELISTFLAG, $GTAGSSTATSFILE, $GTAGSSTATSHISTORY,
+            $GTAGSSTATSHISTORYMAX
 
         Attach the GTAGS() builder to the environment.
     """
@@ -160,6 +551,11 @@ def generate(env, **kw):
                     env.Dir('.').srcnode(),
             GTAGSFLAGS          = [ '--statistics' ],
             GTAGSSTDINFLAGS     = [ '-f', '-' ],
+            GTAGSFILELIST       = 'GTAGS.files',
+            GTAGSFILELISTFLAG   = [ '-f' ],
+            GTAGSSTATSFILE      = None,
+            GTAGSSTATSHISTORY   = None,
+            GTAGSSTATSHISTORYMAX = 100,
             GTAGSCONFIGFLAG     = [ '--gtagsconf' ],
             GTAGSOUTPUTFLAG     = [ ],
             GTAGSOUTPUTS        = [ 'GTAGS', 'GRTAGS', 'GPATH', 'GTAGSROOT' ],
@@ -168,6 +564,21 @@ def generate(env, **kw):
             GTAGSCONFIGLIST     = [ '/usr/local/etc/gtags.conf', '/etc/gtags.conf', os.path.join(os.environ['HOME'], '.globalrc'), '/gtags.conf' ],
             GTAGSKEEPVARIANTDIR = False,
             GTAGSCOMSTR         = None,
+            GTAGSINCREMENTAL    = False,
+            GTAGSINCREMENTALFLAG  = [ '-i' ],
+            GTAGSSINGLEUPDATEFLAG = [ '--single-update' ],
+            GTAGSSINGLEUPDATEMAX  = 8,
+            GTAGSSTATEFILE      = 'GTAGS.state',
+            GTAGSLIBLAYER       = False,
+            GTAGSLIBPREFIXES    = [ '/usr/include', '/usr/local/include', '/usr/lib/gcc', '/usr/lib/clang' ],
+            GTAGSLIBLAYERDIR    = os.path.join(os.environ['HOME'], '.cache', 'xref-tag', 'gtags'),
+            GTAGSLIBLAYERKEY    = [ ],
+            GTAGSLIBPATHFILE    = 'GTAGSLIBPATH',
+            GTAGSJOBS           = 1,
+            GTAGSSHARDDIR       = 'GTAGS.shards',
+            GTAGSDRIVER         = 'global.sh',
+            GTAGSGLOBAL         = 'global',
+            GTAGSTHROUGHFLAG    = [ '-T' ],
             GTAGSCONFIG     = \
                 [
                     'default:\\',
@@ -11,6 +11,12 @@
 import sys
 import os
 import re
+import time
+import errno
+import hashlib
+import shutil
+import threading
+import subprocess
 import SCons.Script
 
 from generated_list import generated_list
@@ -308,3 +314,382 @@ def has_flags(flag_list, sublist):
                 return False
 
     return True
+
+def to_bytes(text):
+    """ encode `text` with UTF-8 if needed, so it can be written to a binary stream or a hash """
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+def is_under_prefix(path, prefix_list):
+    """ check if absolute `path` is one of the directories in `prefix_list`, or is found under one of them """
+    for prefix in prefix_list:
+        prefix = prefix.rstrip(os.sep) or os.sep
+
+        if path == prefix or path.startswith(prefix if prefix == os.sep else prefix + os.sep):
+            return True
+
+    return False
+
+def partition_by_prefix(file_list, prefix_list):
+    """
+        Split `file_list` in two lists: the files found under one of the directories in `prefix_list` and
+        all other files. File names are compared in absolute form, but are returned unchanged.
+    """
+    prefix_list = [ os.path.abspath(prefix) for prefix in prefix_list ]
+    inside, outside = [ ], [ ]
+
+    for file in file_list:
+        if is_under_prefix(os.path.abspath(str(file)), prefix_list):
+            inside.append(file)
+        else:
+            outside.append(file)
+
+    return inside, outside
+
+def absolute_paths(file_list):
+    """ return the absolute path for each file name in the list, normalizing each directory only once """
+    directories = { }
+    path_list   = [ ]
+
+    for file_name in file_list:
+        dir_name, base_name = os.path.split(file_name)
+
+        if dir_name not in directories:
+            directories[dir_name] = os.path.abspath(dir_name)
+
+        path_list.append(os.path.join(directories[dir_name], base_name))
+
+    return path_list
+
+def file_list_signature(file_list, extra_keys = [ ]):
+    """
+        Return a hex digest over the `extra_keys` strings and over the name, size and modification time of
+        each file in `file_list`. Used as a cache key for outputs generated from a set of files.
+    """
+    digest = hashlib.sha1()
+
+    for key in extra_keys:
+        digest.update(to_bytes(str(key) + '\0'))
+
+    for file_name in sorted(file_list):
+        try:
+            stat = os.stat(file_name)
+            digest.update(to_bytes(file_name + '\0' + str(stat.st_size) + '\0' + repr(stat.st_mtime) + '\0'))
+        except OSError:
+            digest.update(to_bytes(file_name + '\0-\0'))
+
+    return digest.hexdigest()
+
+def list_directory(dir_name):
+    """ return a list of (name, is_dir, is_link, size, mtime) tuples for the entries in a directory """
+    entries = [ ]
+
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(dir_name):
+            try:
+                is_dir = entry.is_dir()
+                stat   = entry.stat() if not is_dir else None
+                entries.append((entry.name, is_dir, entry.is_symlink(), stat and stat.st_size, stat and stat.st_mtime))
+            except OSError:
+                pass
+    else:
+        for name in os.listdir(dir_name):
+            path = os.path.join(dir_name, name)
+
+            try:
+                is_dir = os.path.isdir(path)
+                stat   = os.stat(path) if not is_dir else None
+                entries.append((name, is_dir, os.path.islink(path), stat and stat.st_size, stat and stat.st_mtime))
+            except OSError:
+                pass
+
+    return sorted(entries)
+
+def directory_fingerprint(dir_list, suffix_list, recursive, extra_keys = [ ]):
+    """
+        Return a hex digest over the `extra_keys` strings and over the name, size and modification time of
+        the files with a suffix in `suffix_list` found in the given directories, and in their subdirectories
+        if `recursive` is set. Symbolic links to directories are not followed. Used to check if a directory
+        tree changed without running the indexer over it.
+    """
+    digest = hashlib.sha1()
+
+    for key in extra_keys:
+        digest.update(to_bytes(str(key) + '\0'))
+
+    match_all = len(suffix_list) and suffix_list[0] == '*'
+    suffixes  = set(suffix_list)
+
+    for top_dir in sorted(set(dir_list)):
+        digest.update(to_bytes(top_dir + '\0\0'))
+        pending = [ top_dir ]
+
+        while pending:
+            dir_name = pending.pop()
+
+            try:
+                entries = list_directory(dir_name)
+            except OSError:
+                digest.update(to_bytes(dir_name + '\0-\0'))
+                continue
+
+            for name, is_dir, is_link, size, mtime in entries:
+                path = os.path.join(dir_name, name)
+
+                if is_dir:
+                    if recursive and not is_link:
+                        pending.append(path)
+                elif match_all or os.path.splitext(name)[1] in suffixes:
+                    digest.update(to_bytes(path + '\0' + str(size) + '\0' + repr(mtime) + '\0'))
+
+    return digest.hexdigest()
+
+def read_file(file_name, default = None):
+    """ return the content of a small text file, or `default` if the file can not be read """
+    try:
+        with open(file_name, 'r') as input_file:
+            return input_file.read()
+    except (IOError, OSError):
+        return default
+
+def write_file(file_name, content):
+    """ write a small text file atomically, through a temporary file renamed over the target """
+    temp_name = file_name + '.' + str(os.getpid()) + '.tmp'
+
+    with open(temp_name, 'w') as output_file:
+        output_file.write(content)
+
+    replace_file(temp_name, file_name)
+
+def replace_file(source_name, target_name):
+    """ rename `source_name` over `target_name`, atomically where the platform allows it """
+    try:
+        os.rename(source_name, target_name)
+    except OSError:
+        if not sys.platform.startswith('win') or not os.path.exists(target_name):
+            raise
+
+        os.remove(target_name)
+        os.rename(source_name, target_name)
+
+def link_file(source_name, link_name):
+    """ (re-)create `link_name` as a symbolic link to `source_name`, or as a copy if symlinks are not available """
+    if os.path.lexists(link_name):
+        os.remove(link_name)
+
+    if hasattr(os, 'symlink'):
+        os.symlink(source_name, link_name)
+    else:
+        shutil.copyfile(source_name, link_name)
+
+def group_by_directory(file_list, group_count):
+    """
+        Partition `file_list` into up to `group_count` lists, keeping files from the same directory together
+        and balancing the total size (in bytes) of the files in each list.
+    """
+    directories = { }
+
+    for file_name in file_list:
+        try:
+            size = os.path.getsize(file_name)
+        except OSError:
+            size = 0
+
+        directory = directories.setdefault(os.path.dirname(file_name), [ 0, [ ] ])
+        directory[0] += size
+        directory[1].append(file_name)
+
+    groups = [ [ 0, [ ] ] for index in range(max(1, min(group_count, len(directories)))) ]
+
+    for size, dir_name in sorted([ (-directory[0], dir_name) for dir_name, directory in directories.items() ]):
+        group = min(groups, key = lambda group: group[0])
+        group[0] -= size
+        group[1] += directories[dir_name][1]
+
+    return [ group[1] for group in groups ]
+
+def run_parallel(function, items, jobs):
+    """ call `function` for each item on up to `jobs` threads, and return the list of results in item order """
+    items   = list(items)
+    results = [ None ] * len(items)
+    errors  = [ ]
+    indexes = iter(range(len(items)))
+    lock    = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next(indexes, None)
+
+            if index is None:
+                return
+
+            try:
+                results[index] = function(items[index])
+            except Exception:
+                errors.append(sys.exc_info()[1])
+
+    if jobs <= 1 or len(items) <= 1:
+        return [ function(item) for item in items ]
+
+    threads = [ threading.Thread(target = worker) for index in range(min(jobs, len(items))) ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
+
+def write_output(stream, data):
+    """ write `data` bytes to a text or binary output `stream`, like sys.stdout or sys.stderr """
+    if hasattr(stream, 'buffer'):
+        stream.flush()
+        stream.buffer.write(data)
+        stream.buffer.flush()
+    else:
+        stream.write(data if isinstance(data, str) else data.decode('utf-8', 'replace'))
+        stream.flush()
+
+class CommandResult:
+    """ Outcome of a command run by run_command(): exit code, captured output and timings """
+    def __init__(self, command):
+        self.command     = command
+        self.returncode  = None
+        self.stdout      = None
+        self.stderr      = b''
+        self.input_count = 0
+        self.start_time  = None
+        self.feed_time   = None
+        self.end_time    = None
+
+    def elapsed(self):
+        """ Return wall time in seconds from process start until the process exited and all output was read """
+        return self.end_time - self.start_time
+
+    def timing_summary(self):
+        """ Return a one-line description of the process run time and input size """
+        summary = os.path.basename(str(self.command[0])) + ': ' + '%.3fs' % self.elapsed()
+
+        if self.feed_time is not None:
+            summary += ', ' + str(self.input_count) + ' input lines fed in ' + '%.3fs' % self.feed_time
+
+        return summary + ', exit code ' + str(self.returncode)
+
+def run_command(command, input_lines = None, cwd = None, env = None, capture_stdout = False, echo_stderr = True, echo_stdout = False, chunk_size = 256 * 1024):
+    """
+        Run `command` as a subprocess and wait for it to complete. Shared driver for all the indexer actions.
+
+        If `input_lines` is not None, the lines are written to the process standard input from a feeder
+        thread, with a new-line after each line, in buffered chunks of about `chunk_size` bytes instead of a
+        write for each line. The process standard error is drained concurrently, so a noisy command can not
+        stall on a full pipe, and is kept in the result, and echoed to sys.stderr if `echo_stderr` is True.
+        Standard output is captured in the result only when `capture_stdout` is True, otherwise it is
+        inherited from the current process. Captured output is also echoed to sys.stdout as it is read, if
+        `echo_stdout` is True.
+
+        Returns a CommandResult object. An error from the feeder thread, for example from the `input_lines`
+        iterator, is raised again after the command exits, except for a broken pipe when the command does not
+        read all of its input.
+    """
+    result = CommandResult(command)
+    result.start_time = time.time()
+
+    process = \
+        subprocess.Popen\
+            (
+                command,
+                bufsize = -1,
+                stdin   = subprocess.PIPE if input_lines is not None else None,
+                stdout  = subprocess.PIPE if capture_stdout else None,
+                stderr  = subprocess.PIPE,
+                cwd     = cwd,
+                env     = env
+            )
+
+    stdout_chunks = [ ]
+    stderr_chunks = [ ]
+
+    def drain_stream(stream, chunks, echo_stream):
+        while True:
+            data = os.read(stream.fileno(), chunk_size)
+
+            if not data:
+                break
+
+            chunks.append(data)
+
+            if echo_stream is not None:
+                write_output(echo_stream, data)
+
+        stream.close()
+
+    feed_errors = [ ]
+
+    def feed_input():
+        chunk, chunk_length = [ ], 0
+
+        try:
+            for line in input_lines:
+                line = to_bytes(line + '\n')
+                chunk.append(line)
+                chunk_length += len(line)
+                result.input_count += 1
+
+                if chunk_length >= chunk_size:
+                    process.stdin.write(b''.join(chunk))
+                    chunk, chunk_length = [ ], 0
+
+            if chunk:
+                process.stdin.write(b''.join(chunk))
+        except (IOError, OSError) as error:
+            # the command exited before reading all input, the exit code will be reported
+            if error.errno not in [ errno.EPIPE, errno.EINVAL ]:
+                feed_errors.append(error)
+        except Exception:
+            # reported to the caller after the command exits
+            feed_errors.append(sys.exc_info()[1])
+        finally:
+            try:
+                process.stdin.close()
+            except (IOError, OSError):
+                pass
+
+        result.feed_time = time.time() - result.start_time
+
+    threads = \
+        [
+            threading.Thread
+                (
+                    target = drain_stream,
+                    args   = (process.stderr, stderr_chunks, sys.stderr if echo_stderr else None)
+                )
+        ]
+
+    if capture_stdout:
+        threads.append(threading.Thread(target = drain_stream, args = (process.stdout, stdout_chunks, sys.stdout if echo_stdout else None)))
+
+    if input_lines is not None:
+        threads.append(threading.Thread(target = feed_input))
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    result.returncode = process.wait()
+    result.end_time   = time.time()
+    result.stderr     = b''.join(stderr_chunks)
+
+    if capture_stdout:
+        result.stdout = b''.join(stdout_chunks)
+
+    if feed_errors:
+        raise feed_errors[0]
+
+    return result
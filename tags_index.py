@@ -0,0 +1,324 @@
+"""
+    SQLite symbol index for the tags files generated by the TagsFile() builder.
+
+    The index answers queries that a name look-up in the tags file can not, like all members of a class, all
+    symbols of a kind in a directory, or a substring search on symbol names, in milliseconds over millions of
+    tags. Tags are stored in normalized tables for files, kinds, scopes and signatures, with indexes on the
+    queried columns, and a full-text table on the names when SQLite has FTS5 with the trigram tokenizer.
+
+    The index is updated incrementally, keyed by source file: the tags file is streamed twice, first to compute
+    a digest of the tag lines of each source file, then to insert the tags only for the files with a changed
+    digest. Tags for files no longer present are removed.
+
+    Usage:
+        with TagsIndex('tags.db') as index:
+            index.update([ 'tags' ])
+
+            members = index.members('MyClass')
+            entries = index.symbols(kind = 'p', directory = 'src/lib')
+            entries = index.search('Walker')
+
+    All queries return tags_reader.TagEntry records.
+
+    The TagsIndex() builder from 'xref-tag.ctags' tool runs the update for the generated tags files.
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+
+import tags_reader
+
+schema = \
+    [
+        'CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)',
+        'CREATE TABLE IF NOT EXISTS file (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, directory TEXT NOT NULL, digest TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS kind (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS scope (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, name TEXT NOT NULL, UNIQUE (name, kind))',
+        'CREATE TABLE IF NOT EXISTS signature (id INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS tag '
+            '('
+                'id INTEGER PRIMARY KEY, name TEXT NOT NULL, file_id INTEGER NOT NULL REFERENCES file (id), '
+                'kind_id INTEGER REFERENCES kind (id), scope_id INTEGER REFERENCES scope (id), '
+                'signature_id INTEGER REFERENCES signature (id), line INTEGER, address TEXT NOT NULL, '
+                'access TEXT, inherits TEXT, typeref TEXT, fields TEXT'
+            ')',
+        'CREATE INDEX IF NOT EXISTS tag_name        ON tag (name)',
+        'CREATE INDEX IF NOT EXISTS tag_name_nocase ON tag (name COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS tag_file        ON tag (file_id)',
+        'CREATE INDEX IF NOT EXISTS tag_kind        ON tag (kind_id, file_id)',
+        'CREATE INDEX IF NOT EXISTS tag_scope       ON tag (scope_id)',
+        'CREATE INDEX IF NOT EXISTS file_directory  ON file (directory)'
+    ]
+
+fts_schema = "CREATE VIRTUAL TABLE IF NOT EXISTS tag_fts USING fts5 (name, tokenize = 'trigram')"
+
+""" tag fields stored in their own columns, other fields are kept as JSON in the `fields` column """
+column_fields = [ 'line', 'access', 'inherits', 'typeref', 'signature' ] + tags_reader.scope_fields
+
+tag_columns = \
+    'tag.name, file.path, tag.address, kind.name, scope.kind, scope.name, signature.text, ' \
+    'tag.line, tag.access, tag.inherits, tag.typeref, tag.fields'
+
+tag_query = \
+    'SELECT ' + tag_columns + ' FROM tag JOIN file ON file.id = tag.file_id ' \
+        'LEFT JOIN kind ON kind.id = tag.kind_id LEFT JOIN scope ON scope.id = tag.scope_id ' \
+        'LEFT JOIN signature ON signature.id = tag.signature_id'
+
+def to_text(value):
+    """ convert bytes (python 2 str) to unicode text for SQLite """
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
+
+def to_str(value):
+    """ convert text from SQLite to native str """
+    if str is bytes and isinstance(value, type(u'')):
+        return value.encode('utf-8')
+
+    return value
+
+def tag_lines(tags_file):
+    """ generator for the (file name, line) pairs of all tag lines in the file, excluding pseudo-tags """
+    with open(tags_file, 'rb') as tags:
+        for line in tags:
+            line = line.rstrip(b'\r\n')
+
+            if line and not line.startswith(b'!_'):
+                fields = line.split(b'\t', 2)
+
+                if len(fields) == 3:
+                    yield fields[1], line
+
+def row_entry(row):
+    """ build a TagEntry from a row selected with `tag_columns` """
+    name, path, address, kind, scope_kind, scope_name, signature, line, access, inherits, typeref, fields = \
+        [ to_str(value) for value in row ]
+
+    fields = dict([ (to_str(k), to_str(v)) for k, v in json.loads(fields).items() ]) if fields else { }
+
+    for field, value in [ ('line', line), ('access', access), ('inherits', inherits), ('typeref', typeref), ('signature', signature) ]:
+        if value is not None:
+            fields[field] = str(value)
+
+    if scope_kind is not None:
+        fields[scope_kind] = scope_name
+
+    return tags_reader.TagEntry(name, path, address, kind, fields)
+
+class TagsIndex:
+    """ SQLite database with the tags from one or more tags files """
+    def __init__(self, db_file):
+        self.db_file    = db_file
+        self.connection = sqlite3.connect(db_file)
+        self.has_fts    = True
+
+        for statement in schema:
+            self.connection.execute(statement)
+
+        try:
+            self.connection.execute(fts_schema)
+        except sqlite3.OperationalError:
+            # no FTS5 or no trigram tokenizer in this SQLite version, substring search will scan the names
+            self.has_fts = False
+
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lookup_id(self, cache, table, columns, values):
+        """ return the row id for the given `values` in a normalized `table`, inserting a new row if needed """
+        if values not in cache:
+            condition = ' AND '.join([ column + ' = ?' for column in columns ])
+            row = self.connection.execute('SELECT id FROM ' + table + ' WHERE ' + condition, values).fetchone()
+
+            if row is None:
+                cursor = \
+                    self.connection.execute\
+                        (
+                            'INSERT INTO ' + table + ' (' + ', '.join(columns) + ') VALUES (' + ', '.join([ '?' ] * len(columns)) + ')',
+                            values
+                        )
+                cache[values] = cursor.lastrowid
+            else:
+                cache[values] = row[0]
+
+        return cache[values]
+
+    def remove_file_tags(self, file_id):
+        if self.has_fts:
+            self.connection.execute('DELETE FROM tag_fts WHERE rowid IN (SELECT id FROM tag WHERE file_id = ?)', (file_id, ))
+
+        self.connection.execute('DELETE FROM tag WHERE file_id = ?', (file_id, ))
+
+    def update(self, tags_files):
+        """
+            Update the index with the tags from the given list of tags files. Only the tags for source files
+            with changed tag lines are re-inserted. Returns the tuple (changed file count, removed file count).
+        """
+        digests = { }
+
+        for tags_file in tags_files:
+            for file_name, line in tag_lines(tags_file):
+                if file_name not in digests:
+                    digests[file_name] = hashlib.sha1()
+
+                digests[file_name].update(line + b'\n')
+
+        digests = dict([ (to_text(file_name), digest.hexdigest()) for file_name, digest in digests.items() ])
+        indexed = dict([ (path, (file_id, digest)) for file_id, path, digest in self.connection.execute('SELECT id, path, digest FROM file') ])
+
+        changed = { }
+        removed = [ path for path in indexed if path not in digests ]
+
+        with self.connection:
+            for path in removed:
+                self.remove_file_tags(indexed[path][0])
+                self.connection.execute('DELETE FROM file WHERE id = ?', (indexed[path][0], ))
+
+            for path, digest in digests.items():
+                if path in indexed:
+                    if indexed[path][1] != digest:
+                        self.remove_file_tags(indexed[path][0])
+                        self.connection.execute('UPDATE file SET digest = ? WHERE id = ?', (digest, indexed[path][0]))
+                        changed[path] = indexed[path][0]
+                else:
+                    changed[path] = \
+                        self.connection.execute\
+                            (
+                                'INSERT INTO file (path, directory, digest) VALUES (?, ?, ?)',
+                                (path, os.path.dirname(path), digest)
+                            ) \
+                                .lastrowid
+
+            if changed:
+                self.insert_tags(tags_files, changed)
+
+            if removed or changed:
+                for table, column in [ ('kind', 'kind_id'), ('scope', 'scope_id'), ('signature', 'signature_id') ]:
+                    self.connection.execute\
+                        (
+                            'DELETE FROM ' + table + ' WHERE id NOT IN (SELECT ' + column + ' FROM tag WHERE ' + column + ' IS NOT NULL)'
+                        )
+
+        return len(changed), len(removed)
+
+    def insert_tags(self, tags_files, file_ids):
+        """ insert tags from the tags files for the source files in the `file_ids` map """
+        kind_cache, scope_cache, signature_cache = { }, { }, { }
+        rows = [ ]
+
+        # tag ids are given explicitly, so the rows for the full-text table can be inserted in the same batch
+        tag_id = self.connection.execute('SELECT COALESCE(MAX(id), 0) FROM tag').fetchone()[0]
+
+        for tags_file in tags_files:
+            for file_name, line in tag_lines(tags_file):
+                file_id = file_ids.get(to_text(file_name))
+
+                if file_id is None:
+                    continue
+
+                entry  = tags_reader.parse_tag_line(line)
+                fields = dict([ (to_text(k), to_text(v)) for k, v in entry.fields.items() if k not in column_fields ])
+                scope  = entry.scope
+                tag_id += 1
+
+                rows.append\
+                    (
+                        (
+                            tag_id,
+                            to_text(entry.name),
+                            file_id,
+                            self.lookup_id(kind_cache, 'kind', ('name', ), (to_text(entry.kind), )) if entry.kind else None,
+                            self.lookup_id(scope_cache, 'scope', ('kind', 'name'), (to_text(scope[0]), to_text(scope[1]))) if scope else None,
+                            self.lookup_id(signature_cache, 'signature', ('text', ), (to_text(entry.signature), )) if entry.signature else None,
+                            entry.line,
+                            to_text(entry.address),
+                            to_text(entry.access),
+                            to_text(entry.fields.get('inherits')),
+                            to_text(entry.typeref),
+                            json.dumps(fields, sort_keys = True) if fields else None
+                        )
+                    )
+
+                if len(rows) >= 10000:
+                    self.insert_rows(rows)
+                    rows = [ ]
+
+        self.insert_rows(rows)
+
+    def insert_rows(self, rows):
+        """ insert a batch of tag rows, starting with the tag id and name, and their names in the full-text table """
+        self.connection.executemany\
+            (
+                'INSERT INTO tag '
+                    '(id, name, file_id, kind_id, scope_id, signature_id, line, address, access, inherits, typeref, fields) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+        if self.has_fts:
+            self.connection.executemany('INSERT INTO tag_fts (rowid, name) VALUES (?, ?)', [ row[:2] for row in rows ])
+
+    def query(self, condition = '', args = ( )):
+        return \
+            [
+                row_entry(row)
+                    for row in self.connection.execute(tag_query + (' WHERE ' + condition if condition else '') + ' ORDER BY tag.name, file.path, tag.line', args)
+            ]
+
+    def find(self, name, ignore_case = False):
+        """ return the tags with the given name """
+        return self.query('tag.name = ?' + (' COLLATE NOCASE' if ignore_case else ''), (to_text(name), ))
+
+    def members(self, scope_name, scope_kind = None):
+        """ return the tags declared in the given scope, like all members of a class """
+        if scope_kind is None:
+            return self.query('scope.name = ?', (to_text(scope_name), ))
+
+        return self.query('scope.name = ? AND scope.kind = ?', (to_text(scope_name), to_text(scope_kind)))
+
+    def symbols(self, kind = None, directory = None, recursive = True):
+        """ return the tags of the given kind, in the given source directory (and its subdirectories) """
+        conditions, args = [ ], [ ]
+
+        if kind is not None:
+            conditions.append('kind.name = ?')
+            args.append(to_text(kind))
+
+        if directory is not None:
+            directory = to_text(os.path.normpath(directory))
+
+            if directory == '.':
+                directory = ''     # file names in the tags file are relative to the current directory
+
+            if not recursive:
+                conditions.append('file.directory = ?')
+                args.append(directory)
+            elif directory:
+                # exact, case-sensitive comparison of the directory prefix, without LIKE wildcards
+                conditions.append('(file.directory = ? OR substr(file.directory, 1, ?) = ?)')
+                args += [ directory, len(directory) + 1, directory + '/' ]
+
+        return self.query(' AND '.join(conditions), tuple(args))
+
+    def search(self, substring):
+        """ return the tags with names containing `substring`, case-insensitive """
+        substring = to_text(substring)
+
+        if self.has_fts and len(substring) >= 3:
+            return self.query\
+                (
+                    'tag.id IN (SELECT rowid FROM tag_fts WHERE tag_fts MATCH ?)',
+                    ('"' + substring.replace('"', '""') + '"', )
+                )
+
+        pattern = '%' + substring.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+        return self.query("tag.name LIKE ? ESCAPE '\\'", (pattern, ))
@@ -0,0 +1,297 @@
+"""
+    Read-only look-up API for the tags file generated by the TagsFile() builder, for use in scripts and hooks.
+
+    The tags file is memory-mapped and searched with a binary search on the tag name, so a look-up only touches a
+    few pages of the file, and the file is never loaded in memory. Only the matching lines are parsed, into
+    TagEntry records with the extension fields enabled by the default $CTAGSFLAGS (`--fields=+iaSt`).
+
+    Usage:
+        with TagsReader('tags') as tags:
+            for entry in tags.find('main'):
+                print(entry.file + ':' + str(entry.line) + ' ' + entry.kind)
+
+            entries = tags.find_prefix('Xref')
+            entries = tags.find('xrefwalker', ignore_case = True)
+
+    Case-insensitive searches use a binary search when the file is sorted with `ctags --sort=foldcase`, and a
+    linear scan otherwise. Unsorted files (`--sort=no`) are always scanned.
+
+    The module can also be run as a script:
+        python tags_reader.py [-i] [-p] tags-file name...
+"""
+
+import sys
+import os
+import mmap
+
+""" value of the !_TAG_FILE_SORTED pseudo-tag for files sorted with case-folding """
+SORTED_FOLDCASE = 2
+
+""" extension field names that give the enclosing scope of a tag """
+scope_fields = [ 'class', 'struct', 'union', 'enum', 'namespace', 'function', 'interface', 'module', 'package' ]
+
+field_escapes = { 't': '\t', 'r': '\r', 'n': '\n', '\\': '\\' }
+
+def decode(data):
+    """ translate bytes read from the tags file to native str """
+    return data if str is bytes else data.decode('utf-8', 'surrogateescape')
+
+def encode(text):
+    """ translate a native str to the bytes found in the tags file """
+    return text if isinstance(text, bytes) else text.encode('utf-8', 'surrogateescape')
+
+def unescape_field(value):
+    """ expand backslash escape sequences in an extension field value """
+    if '\\' not in value:
+        return value
+
+    chars = [ ]
+    index = 0
+
+    while index < len(value):
+        if value[index] == '\\' and index + 1 < len(value) and value[index + 1] in field_escapes:
+            chars.append(field_escapes[value[index + 1]])
+            index += 2
+        else:
+            chars.append(value[index])
+            index += 1
+
+    return ''.join(chars)
+
+class TagEntry:
+    """ One tag from the tags file, with the name, file, address (ex command), kind and extension fields """
+    def __init__(self, name, file, address, kind, fields):
+        self.name    = name
+        self.file    = file
+        self.address = address
+        self.kind    = kind
+        self.fields  = fields
+
+    @property
+    def line(self):
+        """ line number from the `line:` field or from a numeric address, or None """
+        if 'line' in self.fields:
+            return int(self.fields['line'])
+
+        if self.address.isdigit():
+            return int(self.address)
+
+        return None
+
+    @property
+    def access(self):
+        return self.fields.get('access')
+
+    @property
+    def inherits(self):
+        return self.fields['inherits'].split(',') if self.fields.get('inherits') else [ ]
+
+    @property
+    def signature(self):
+        return self.fields.get('signature')
+
+    @property
+    def typeref(self):
+        return self.fields.get('typeref')
+
+    @property
+    def scope(self):
+        """ tuple (scope kind, scope name) for tags that are members of a class, namespace, etc, or None """
+        for field in scope_fields:
+            if field in self.fields:
+                return field, self.fields[field]
+
+        return None
+
+    @property
+    def file_scope(self):
+        """ True for tags that are only visible in the file, like static functions """
+        return 'file' in self.fields
+
+    def __repr__(self):
+        return 'TagEntry(' + ', '.join([ repr(x) for x in [ self.name, self.file, self.address, self.kind, self.fields ] ]) + ')'
+
+def parse_tag_line(line):
+    """ parse one line (bytes, without the new-line) from a tags file into a TagEntry """
+    name, file, rest = line.split(b'\t', 2)
+
+    field_start = rest.find(b';"\t')
+
+    if field_start >= 0:
+        address     = rest[:field_start]
+        field_list  = rest[field_start + 3:].split(b'\t')
+    else:
+        address     = rest[:-2] if rest.endswith(b';"') else rest
+        field_list  = [ ]
+
+    kind   = None
+    fields = { }
+
+    for field in field_list:
+        field = decode(field)
+        colon = field.find(':')
+
+        if colon < 0:
+            kind = field
+        else:
+            fields[field[:colon]] = unescape_field(field[colon + 1:])
+
+    if 'kind' in fields:
+        kind = fields.pop('kind')
+
+    return TagEntry(decode(name), decode(file), decode(address), kind, fields)
+
+class TagsReader:
+    """ Memory-mapped tags file, searched by tag name """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file      = open(file_name, 'rb')
+        self.size      = os.fstat(self.file.fileno()).st_size
+        self.data      = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ) if self.size else b''
+        self.header    = { }
+        self.sorted    = 0
+
+        position = 0
+
+        while self.data[position:position + 2] == b'!_':
+            line_end = self.line_end(position)
+            fields   = self.data[position:line_end].split(b'\t')
+
+            self.header[decode(fields[0])] = decode(fields[1]) if len(fields) > 1 else ''
+            position = line_end + 1
+
+        self.data_start = min(position, self.size)
+
+        if self.header.get('!_TAG_FILE_SORTED', '0').isdigit():
+            self.sorted = int(self.header.get('!_TAG_FILE_SORTED', '0'))
+
+    def close(self):
+        if self.size:
+            self.data.close()
+
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def line_end(self, position):
+        """ return the position of the new-line ending the line at `position`, or the file size """
+        line_end = self.data.find(b'\n', position)
+
+        return self.size if line_end < 0 else line_end
+
+    def line_start(self, position):
+        """ return the start position of the line containing `position` """
+        return self.data.rfind(b'\n', self.data_start, position) + 1 or self.data_start
+
+    def tag_name(self, position, line_end):
+        """ return the tag name (bytes) for the line starting at `position` """
+        name_end = self.data.find(b'\t', position, line_end)
+
+        return self.data[position:line_end if name_end < 0 else name_end]
+
+    def lower_bound(self, key, fold):
+        """ binary search for the position of the first line with fold(name) not less than `key` """
+        low, high = self.data_start, self.size
+
+        while low < high:
+            middle     = self.line_start((low + high) // 2)
+            middle_end = self.line_end(middle)
+
+            if fold(self.tag_name(middle, middle_end)) < key:
+                low = middle_end + 1
+            else:
+                high = middle
+
+        return low
+
+    def scan(self, position, accept, in_range = lambda name: True):
+        """ parse the lines starting at `position` with accept(name) True, while in_range(name) is True """
+        entries = [ ]
+
+        while position < self.size:
+            line_end = self.line_end(position)
+            name     = self.tag_name(position, line_end)
+
+            if not in_range(name):
+                break
+
+            if line_end > position and accept(name):
+                entries.append(parse_tag_line(self.data[position:line_end]))
+
+            position = line_end + 1
+
+        return entries
+
+    def search(self, key, match, ignore_case):
+        """ return entries for tag names matching `key`, using binary search if the file sort order allows it """
+        folded_key = key.lower()
+        identity   = lambda name: name
+
+        if self.sorted == SORTED_FOLDCASE:
+            # `ctags --sort=foldcase` orders the names by their upper-case form, like `sort -f`, so names
+            # with characters between 'Z' and 'a' (like '_') are in a different place than for lower-case
+            position = self.lower_bound(key.upper(), lambda name: name.upper())
+            in_range = lambda name: match(name.lower(), folded_key)
+
+            if ignore_case:
+                return self.scan(position, in_range, in_range)
+
+            return self.scan(position, lambda name: match(name, key), in_range)
+
+        if self.sorted and not ignore_case:
+            in_range = lambda name: match(name, key)
+
+            return self.scan(self.lower_bound(key, identity), in_range, in_range)
+
+        if ignore_case:
+            return self.scan(self.data_start, lambda name: match(name.lower(), folded_key))
+
+        return self.scan(self.data_start, lambda name: match(name, key))
+
+    def find(self, name, ignore_case = False):
+        """ return the list of TagEntry records for the tags with the given name """
+        return self.search(encode(name), lambda tag_name, key: tag_name == key, ignore_case)
+
+    def find_prefix(self, prefix, ignore_case = False):
+        """ return the list of TagEntry records for the tags with names starting with `prefix` """
+        return self.search(encode(prefix), lambda tag_name, key: tag_name.startswith(key), ignore_case)
+
+    def entries(self):
+        """ generator for all TagEntry records in the file, in file order """
+        position = self.data_start
+
+        while position < self.size:
+            line_end = self.line_end(position)
+
+            if line_end > position:
+                yield parse_tag_line(self.data[position:line_end])
+
+            position = line_end + 1
+
+def main(argv):
+    ignore_case = '-i' in argv
+    is_prefix   = '-p' in argv
+    args        = [ arg for arg in argv if arg not in [ '-i', '-p' ] ]
+
+    if len(args) < 2:
+        sys.stderr.write('Syntax: ' + os.path.basename(sys.argv[0]) + ' [-i] [-p] tags-file name...\n')
+        return 2
+
+    with TagsReader(args[0]) as tags:
+        for name in args[1:]:
+            if is_prefix:
+                entries = tags.find_prefix(name, ignore_case)
+            else:
+                entries = tags.find(name, ignore_case)
+
+            for entry in entries:
+                print('\t'.join([ entry.name, entry.file, entry.address, entry.kind or '' ]))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
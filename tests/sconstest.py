@@ -0,0 +1,90 @@
+"""
+    Helpers for the tests: a temporary project directory with an SConstruct file, that loads the tools from
+    this repository with `toolpath`, and runs SCons in a separate process.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+""" directory with the tools, added to `sys.path` for the tests that import the modules directly """
+TOOL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if TOOL_DIR not in sys.path:
+    sys.path.insert(0, TOOL_DIR)
+
+try:
+    import SCons.Script
+    has_scons = True
+except ImportError:
+    has_scons = False
+
+requires_scons = unittest.skipUnless(has_scons, 'SCons is not installed')
+
+def has_program(name):
+    """ check if `name` is an executable found in PATH """
+    for path_dir in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(path_dir, name), os.X_OK):
+            return True
+
+    return False
+
+requires_gcc = unittest.skipUnless(has_program('gcc'), 'gcc is not installed')
+
+class TempDirTestCase(unittest.TestCase):
+    """ test case with a temporary directory, removed after the test """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'xref-tag-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+
+    def path(self, *names):
+        return os.path.join(self.dir, *names)
+
+    def write(self, name, text):
+        file_name = self.path(name)
+
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+
+        with open(file_name, 'w') as output:
+            output.write(text)
+
+        return file_name
+
+    def read(self, name):
+        with open(self.path(name)) as input_file:
+            return input_file.read()
+
+class SConsTestCase(TempDirTestCase):
+    """ test case that runs SCons on an SConstruct file in the temporary directory """
+    def sconstruct(self, tools, text):
+        """ write the SConstruct file, creating `env` with the given tools loaded from this repository """
+        self.write\
+            (
+                'SConstruct',
+                'import sys\n'
+                'env = Environment(tools = [ \'default\' ] + ' + repr(tools) + ', toolpath = [ ' + repr(TOOL_DIR) + ' ])\n'
+                    + text
+            )
+
+    def scons(self, *args):
+        """ run SCons with the given arguments, and return the output, failing the test if SCons fails """
+        process = \
+            subprocess.Popen\
+                (
+                    [ sys.executable, '-c', 'import SCons.Script; SCons.Script.main()', '-Q' ] + list(args),
+                    cwd    = self.dir,
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.STDOUT
+                )
+
+        output = process.communicate()[0].decode('utf-8', 'replace')
+
+        self.assertEqual(process.returncode, 0, output)
+
+        return output
@@ -0,0 +1,94 @@
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sconstest import TempDirTestCase
+
+import call_graph
+from call_graph_reader import CallGraphReader
+
+""" `cflow --all --all --brief --print-level` output, with a recursive function and two mutually recursive ones """
+CALLS_TREE = \
+    [
+        '{   0} expr() <static int expr (void) at parse.c:20> (R):',
+        '{   1}     term() <static int term (void) at parse.c:30> (R)',
+        '{   0} fact() <int fact (int n) at main.c:3> (R):',
+        '{   1}     fact() <int fact (int n) at main.c:3> (R) (recursive: see 3)',
+        '{   0} main() <int main (int argc,char **argv) at main.c:10>:',
+        '{   1}     parse() <int parse (const char *s) at parse.c:5>',
+        '{   1}     printf()',
+        '{   1}     fact() <int fact (int n) at main.c:3> (R)',
+        '{   0} parse() <int parse (const char *s) at parse.c:5>:',
+        '{   1}     expr() <static int expr (void) at parse.c:20> (R)',
+        '{   0} term() <static int term (void) at parse.c:30> (R):',
+        '{   1}     expr() <static int expr (void) at parse.c:20> (R)',
+        '{   1}     printf()'
+    ]
+
+""" direct tree for main(), as written by `cflow` """
+MAIN_TREE = \
+    'main() <int main (int argc,char **argv) at main.c:10>:\n' \
+    '    parse() <int parse (const char *s) at parse.c:5>:\n' \
+    '        expr() <static int expr (void) at parse.c:20> (R):\n' \
+    '            term() <static int term (void) at parse.c:30> (R):\n' \
+    '                expr() <static int expr (void) at parse.c:20> (recursive: see 3)\n' \
+    '                printf()\n' \
+    '    printf()\n' \
+    '    fact() <int fact (int n) at main.c:3> (R):\n' \
+    '        fact() <int fact (int n) at main.c:3> (recursive: see 8)\n'
+
+class CallGraphTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+
+        self.graph = call_graph.CallGraph()
+        self.graph.add_tree(CALLS_TREE)
+
+    def test_calls(self):
+        self.assertEqual(self.graph.calls['main'], [ 'parse', 'printf', 'fact' ])
+        self.assertEqual(self.graph.definitions['expr'], ('static int expr (void)', 'parse.c', 20))
+        self.assertEqual(self.graph.recursive_functions(), set([ 'expr', 'term', 'fact' ]))
+        self.assertEqual(self.graph.global_functions(), [ 'fact', 'main', 'parse' ])
+
+    def test_recursion_marks(self):
+        output = StringIO()
+        self.graph.write_tree(output, [ 'main' ])
+
+        self.assertEqual(output.getvalue(), MAIN_TREE)
+
+        output = StringIO()
+        self.graph.write_reverse_tree(output)
+
+        self.assertIn('printf():\n    main() <int main (int argc,char **argv) at main.c:10>\n    term() <static int term (void) at parse.c:30> (R):\n', output.getvalue())
+        self.assertIn('fact() <int fact (int n) at main.c:3> (R):\n    fact() <int fact (int n) at main.c:3> (recursive: see ', output.getvalue())
+
+    def test_binary_round_trip(self):
+        graph_file = self.path('calls.cgraph')
+        self.graph.write_binary(graph_file)
+
+        with CallGraphReader(graph_file) as graph:
+            self.assertEqual(graph.count, 6)
+            self.assertEqual([ graph.name(index) for index in range(graph.count) ], [ 'expr', 'fact', 'main', 'parse', 'printf', 'term' ])
+
+            self.assertEqual(graph.callees('main'), [ 'parse', 'printf', 'fact' ])
+            self.assertEqual(graph.callers('printf'), [ 'main', 'term' ])
+            self.assertEqual(graph.callers('fact'), [ 'fact', 'main' ])
+            self.assertEqual(graph.callees('missing'), [ ])
+
+            self.assertEqual(graph.location('term'), ('parse.c', 30))
+            self.assertEqual(graph.location('main'), ('main.c', 10))
+            self.assertIsNone(graph.location('printf'))
+
+            self.assertEqual(graph.closure('main'), [ 'expr', 'fact', 'parse', 'printf', 'term' ])
+            self.assertEqual(graph.closure('expr'), [ 'printf', 'term' ])
+            self.assertEqual(graph.closure('printf', reverse = True), [ 'expr', 'main', 'parse', 'term' ])
+            self.assertEqual(graph.closure('main', max_depth = 1), [ 'fact', 'parse', 'printf' ])
+
+            self.assertEqual(graph.paths('main', 'printf', 4), [ [ 'main', 'parse', 'expr', 'term', 'printf' ], [ 'main', 'printf' ] ])
+            self.assertEqual(graph.paths('main', 'printf', 1), [ [ 'main', 'printf' ] ])
+            self.assertEqual(graph.paths('expr', 'expr', 2), [ [ 'expr', 'term', 'expr' ] ])
+
+    def test_not_a_call_graph(self):
+        with self.assertRaises(ValueError):
+            CallGraphReader(self.write('calls.cgraph', 'cscope 15 . -c 0000000000\n' * 4))
@@ -0,0 +1,88 @@
+import os
+import json
+
+from sconstest import SConsTestCase, requires_scons, requires_gcc
+
+""" two programs sharing a static library, with the defines for b.o given on the command line """
+SCONSTRUCT = \
+    'lib   = env.StaticLibrary("util", [ "lib.c" ])\n' \
+    'prog1 = env.Program("prog1", [ "main.c", "a.c", env.Object("b.o", "b.c", CPPDEFINES = ARGUMENTS.get("define", [ ])) ], LIBS = [ lib ])\n' \
+    'prog2 = env.Program("prog2", [ env.Object("main2.o", "main.c"), "c.c" ], LIBS = [ lib ])\n' \
+    'env.CompileCommands("compile_commands.json", [ prog1, prog2 ], CCCOM_INCREMENTAL = True)\n' \
+    'env.Clone(CCCOM_SHARDED = True).CompileCommands("sharded.json", [ lib, prog1, prog2 ])\n'
+
+@requires_scons
+@requires_gcc
+class CompileCommandsTest(SConsTestCase):
+    def setUp(self):
+        SConsTestCase.setUp(self)
+
+        for name in [ 'a', 'b', 'c', 'lib' ]:
+            self.write(name + '.c', 'int ' + name + '(void) { return 0; }\n')
+
+        # the object file must change with the define, for the database to be built again
+        self.write('b.c', '#ifdef CHANGED\nint b_changed;\n#endif\nint b(void) { return 0; }\n')
+
+        self.write('main.c', 'int main(void) { return 0; }\n')
+        self.sconstruct([ 'gcc-dep', 'cccom' ], SCONSTRUCT)
+
+    def entries(self, name):
+        return dict([ (entry['output'], entry) for entry in json.loads(self.read(name)) ])
+
+    def test_incremental_reuse(self):
+        self.scons('compile_commands.json')
+
+        self.assertEqual(sorted(self.entries('compile_commands.json')), [ 'a.o', 'b.o', 'c.o', 'lib.o', 'main.o', 'main2.o' ])
+        self.assertTrue(os.path.exists(self.path('compile_commands.json.state')))
+
+        # mark the entry for a.o, keeping the file size and time, to see that it is copied from the previous database
+        database = self.path('compile_commands.json')
+        stat     = os.stat(database)
+
+        self.write('compile_commands.json', self.read('compile_commands.json').replace('"gcc -o a.o', '"GCC -o a.o'))
+        os.utime(database, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.scons('compile_commands.json', 'define=CHANGED')
+
+        entries = self.entries('compile_commands.json')
+
+        self.assertTrue(entries['a.o']['command'].startswith('GCC -o a.o'))
+        self.assertIn('-DCHANGED', entries['b.o']['command'])
+        self.assertEqual(entries['b.o']['file'], 'b.c')
+        self.assertEqual(len(entries), 6)
+
+    def test_shard_merge(self):
+        self.scons('sharded.json')
+
+        self.assertEqual(sorted(os.listdir(self.path('compile_commands.d'))), [ 'libutil_a.json', 'prog1.json', 'prog2.json' ])
+
+        # the library objects are only listed in the fragment for the library
+        self.assertEqual(sorted(self.entries('compile_commands.d/prog1.json')), [ 'a.o', 'b.o', 'main.o' ])
+        self.assertEqual(sorted(self.entries('compile_commands.d/prog2.json')), [ 'c.o', 'main2.o' ])
+        self.assertEqual(sorted(self.entries('compile_commands.d/libutil_a.json')), [ 'lib.o' ])
+
+        merged = json.loads(self.read('sharded.json'))
+        self.assertEqual([ entry['output'] for entry in merged ], [ 'lib.o', 'main.o', 'a.o', 'b.o', 'main2.o', 'c.o' ])
+
+        # only the fragment for the changed program is written again
+        output = self.scons('sharded.json', 'define=CHANGED')
+
+        self.assertIn('Writing ' + os.path.join('compile_commands.d', 'prog1.json'), output)
+        self.assertNotIn('prog2.json', output)
+        self.assertNotIn('libutil_a.json', output)
+        self.assertIn('-DCHANGED', self.entries('sharded.json')['b.o']['command'])
+
+    def test_expand_once_target_reference(self):
+        self.write('sub/d.c', 'int d(void) { return 0; }\n')
+        self.sconstruct([ 'gcc-dep', 'cccom' ], \
+            'env.Append(CPPPATH = [ "${TARGET.dir}/gen" ])\n' \
+            'prog = env.Program("prog", [ "main.c", "sub/d.c" ])\n' \
+            'env.CompileCommands("compile_commands.json", [ prog ])\n')
+
+        self.scons('compile_commands.json')
+
+        entries = self.entries('compile_commands.json')
+
+        # both objects are built with the same environment, but the include path is expanded for each one
+        self.assertIn('-Igen', entries['main.o']['command'].split())
+        self.assertIn('-I' + os.path.join('sub', 'gen'), entries[os.path.join('sub', 'd.o')]['command'].split())
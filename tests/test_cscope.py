@@ -0,0 +1,60 @@
+import sys
+import os
+
+from sconstest import SConsTestCase, requires_scons, requires_gcc
+
+""" `cscope` replacement that logs the arguments and writes empty output files """
+FAKE_CSCOPE = r'''
+import sys
+
+args   = sys.argv[1:]
+output = args[args.index('-f') + 1] if '-f' in args else 'cscope.out'
+
+with open('cscope.log', 'a') as log:
+    log.write(' '.join(args) + ' ' + ' '.join(sys.stdin.read().split()) + '\n')
+
+with open(output, 'w') as xref:
+    xref.write('cscope 15 . -c 0000000000\n')
+
+for ext in [ '.in', '.po' ]:
+    open(output + ext, 'w').close()
+'''
+
+@requires_scons
+@requires_gcc
+class CScopeXRefTest(SConsTestCase):
+    def setUp(self):
+        SConsTestCase.setUp(self)
+
+        self.write('fakecscope.py', FAKE_CSCOPE)
+        self.write('main.c', 'int main(void) { return 0; }\n')
+
+    def build_xref(self, flags):
+        self.sconstruct\
+            (
+                [ 'gcc-dep', 'cscope' ],
+                'env.Replace(CSCOPE = [ sys.executable, File("fakecscope.py").abspath ]' + flags + ')\n'
+                'env.CScopeXRef("cscope.out", [ env.Program("prog", [ "main.c" ]) ])\n'
+            )
+
+        return self.scons()
+
+    def test_builder_runs_cscope(self):
+        self.build_xref('')
+
+        self.assertTrue(os.path.exists(self.path('cscope.out')))
+        self.assertIn('main.c', self.read('cscope.log'))
+
+        # the second build adds the headers found by gcc-dep, then `cscope` should not run again
+        self.build_xref('')
+        runs = len(self.read('cscope.log').splitlines())
+
+        self.build_xref('')
+        self.build_xref('')
+        self.assertEqual(len(self.read('cscope.log').splitlines()), runs)
+
+    def test_incremental_signature(self):
+        self.build_xref(', CSCOPEINCREMENTAL = True')
+
+        self.assertTrue(os.path.exists(self.path('cscope.out.signature')))
+        self.assertIn('-u', self.read('cscope.log').splitlines()[0].split())
@@ -0,0 +1,89 @@
+import os
+
+from sconstest import TempDirTestCase
+
+import cscope_reader
+from cscope_reader import CScopeReader
+
+""" cross-reference lines for two sources, without compression (`cscope -c`) """
+XREF_LINES = \
+    [
+        '\t@main.c', '',
+        '1 int ', '\tgglobal_count', ';', '',
+        '3 int ', '\t$main', '(void)', '',
+        '5 ', '\t`foo', '(1);', '',
+        '6 return ', 'global_count', ';', '',
+        '7 }', '\t}', '',
+        '\t@lib.c', '',
+        '1 int ', '\t$foo', '(int n)', '',
+        '2 { return ', '\t`bar', '(n); }', '',
+        '3 }', '\t}', '',
+        '\t@'
+    ]
+
+def xref_text(directory):
+    body    = '\n'.join(XREF_LINES) + '\n'
+    header  = 'cscope 15 ' + directory + ' -c '
+    trailer = '0\n0\n2\n14\nmain.c\nlib.c\n'
+
+    # the trailer offset is written with a fixed width, so the header length is known in advance
+    return header + '%010d' % (len(header) + 11 + len(body)) + '\n' + body + trailer
+
+class CScopeReaderTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+
+        self.xref_file = self.write('cscope.out', xref_text(self.dir))
+
+    def test_queries(self):
+        with CScopeReader(self.xref_file, cache_file = None) as xref:
+            definitions = xref.definitions('main')
+
+            self.assertEqual([ (ref.file, ref.line, ref.mark) for ref in definitions ], [ ('main.c', 3, '$') ])
+            self.assertEqual(definitions[0].text, 'int main(void)')
+
+            self.assertEqual([ (ref.file, ref.line, ref.function) for ref in xref.callers('foo') ], [ ('main.c', 5, 'main') ])
+            self.assertEqual([ (ref.symbol, ref.line) for ref in xref.callees('main') ], [ ('foo', 5) ])
+            self.assertEqual([ ref.symbol for ref in xref.callees('foo') ], [ 'bar' ])
+            self.assertEqual(xref.callers('foo')[0].text, 'foo(1);')
+
+            self.assertEqual\
+                (
+                    [ (ref.line, ref.is_definition, ref.function) for ref in xref.references('global_count') ],
+                    [ (1, True, None), (6, False, 'main') ]
+                )
+
+            self.assertEqual(xref.references('missing'), [ ])
+            self.assertEqual(xref.callees('bar'), [ ])
+
+    def test_default_cache_file(self):
+        cache_file = self.xref_file + cscope_reader.CACHE_SUFFIX
+
+        with CScopeReader(self.xref_file) as xref:
+            self.assertIsNone(xref.index_file)
+
+        self.assertTrue(os.path.exists(cache_file))
+
+        with CScopeReader(self.xref_file) as xref:
+            self.assertIsNotNone(xref.index_file)
+            self.assertEqual([ ref.line for ref in xref.definitions('foo') ], [ 1 ])
+
+    def test_stale_cache_is_rebuilt(self):
+        with CScopeReader(self.xref_file) as xref:
+            pass
+
+        stat = os.stat(self.xref_file)
+        os.utime(self.xref_file, (stat.st_atime, stat.st_mtime + 10))
+
+        with CScopeReader(self.xref_file) as xref:
+            self.assertIsNone(xref.index_file)
+            self.assertEqual(len(xref.callers('foo')), 1)
+
+        with CScopeReader(self.xref_file) as xref:
+            self.assertIsNotNone(xref.index_file)
+
+    def test_no_cache_file(self):
+        with CScopeReader(self.xref_file, cache_file = None) as xref:
+            xref.definitions('main')
+
+        self.assertFalse(os.path.exists(self.xref_file + cscope_reader.CACHE_SUFFIX))
@@ -0,0 +1,45 @@
+import json
+
+from sconstest import TempDirTestCase, requires_scons
+
+""" `gtags --statistics --verbose` output, with the progress and count lines """
+STATISTICS_OUTPUT = \
+    b'[Sun Oct 18 10:00:00 2026] Gtags started.\n' \
+    b' [1/2] extracting tags of main.c\n' \
+    b' [2/2] extracting tags of lib/util.c\n' \
+    b'Total 42 tags.\n' \
+    b'2 files\n' \
+    b'period                          user[sec] system[sec] elapsed[sec]  %CPU\n' \
+    b'------------------------------- --------- ----------- ------------ -----\n' \
+    b'make GTAGS                          0.010       0.002        0.013  92.3\n' \
+    b'The entire time                     0.020       0.004        0.030  80.0\n'
+
+@requires_scons
+class StatisticsTest(TempDirTestCase):
+    def test_parse_statistics(self):
+        import gtags
+
+        phases, counts = gtags.parse_statistics(STATISTICS_OUTPUT)
+
+        self.assertEqual([ phase['phase'] for phase in phases ], [ 'make GTAGS', 'The entire time' ])
+        self.assertEqual(phases[0]['elapsed'], 0.013)
+        self.assertEqual(phases[1]['cpu'], 80.0)
+        self.assertEqual(counts, { 'tags': 42, 'files': 2, 'extracting': 2 })
+
+    def test_history_is_capped(self):
+        import gtags
+
+        env = { 'GTAGSSTATSFILE': 'stats.json', 'GTAGSSTATSHISTORY': 'history', 'GTAGSSTATSHISTORYMAX': 3 }
+
+        for run in range(5):
+            gtags.write_statistics(self.dir, { 'run': run }, env)
+
+        self.assertEqual(json.loads(self.read('stats.json')), { 'run': 4 })
+        self.assertEqual([ json.loads(line)['run'] for line in self.read('history').splitlines() ], [ 2, 3, 4 ])
+
+    def test_statistics_are_optional(self):
+        import gtags
+
+        gtags.write_statistics(self.dir, { 'run': 0 }, { 'GTAGSSTATSFILE': None, 'GTAGSSTATSHISTORY': 'history', 'GTAGSSTATSHISTORYMAX': 3 })
+
+        self.assertEqual(self.read('history'), '{"run": 0}\n')
@@ -0,0 +1,37 @@
+import sys
+import unittest
+
+from sconstest import requires_scons
+
+""" command that counts the lines on its standard input """
+COUNT_LINES = [ sys.executable, '-c', 'import sys; print(len(sys.stdin.readlines()))' ]
+
+@requires_scons
+class RunCommandTest(unittest.TestCase):
+    def test_input_lines_are_fed(self):
+        import source_browse_base as base
+
+        result = base.run_command(COUNT_LINES, [ 'file' + str(index) + '.c' for index in range(5000) ], capture_stdout = True, chunk_size = 1024)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.strip(), b'5000')
+        self.assertEqual(result.input_count, 5000)
+        self.assertIsNotNone(result.feed_time)
+
+    def test_feeder_error_is_raised(self):
+        import source_browse_base as base
+
+        def input_lines():
+            yield 'main.c'
+            raise ValueError('bad source')
+
+        with self.assertRaises(ValueError):
+            base.run_command(COUNT_LINES, input_lines(), capture_stdout = True)
+
+    def test_unread_input_is_not_an_error(self):
+        import source_browse_base as base
+
+        result = base.run_command([ sys.executable, '-c', 'pass' ], [ 'x' * 1024 ] * 4096, chunk_size = 1024)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertLessEqual(result.input_count, 4096)
@@ -0,0 +1,97 @@
+import sqlite3
+
+from sconstest import TempDirTestCase
+
+from tags_index import TagsIndex
+
+""" tag lines for each source file, in `ctags --fields=+iaSt` format """
+SOURCE_TAGS = \
+    {
+        'src/lib/walker.h':
+            [
+                'TreeWalker\tsrc/lib/walker.h\t/^class TreeWalker$/;"\tc\tline:3',
+                'visit\tsrc/lib/walker.h\t/^    void visit(Node *node);$/;"\tp\tline:5\tclass:TreeWalker\taccess:public\tsignature:(Node *node)'
+            ],
+        'src/lib/sub/node.h':
+            [
+                'Node\tsrc/lib/sub/node.h\t/^struct Node$/;"\ts\tline:1',
+                'next\tsrc/lib/sub/node.h\t/^    Node *next;$/;"\tm\tline:3\tstruct:Node\taccess:public\ttyperef:typename:Node *'
+            ],
+        'src/lib_x/other.h':
+            [
+                'other_walk\tsrc/lib_x/other.h\t/^void other_walk(void);$/;"\tp\tline:1\tsignature:(void)'
+            ],
+        'src/Lib/case.h':
+            [
+                'case_walk\tsrc/Lib/case.h\t/^void case_walk(void);$/;"\tp\tline:1\tsignature:(void)'
+            ],
+        'main.c':
+            [
+                'main\tmain.c\t/^int main(void)$/;"\tf\tline:10\tsignature:(void)'
+            ]
+    }
+
+class TagsIndexTest(TempDirTestCase):
+    def write_tags(self, source_tags):
+        lines = sorted([ line for source in source_tags for line in source_tags[source] ])
+
+        return self.write('tags', '!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n' + ''.join([ line + '\n' for line in lines ]))
+
+    def test_update_and_queries(self):
+        tags_file = self.write_tags(SOURCE_TAGS)
+
+        with TagsIndex(self.path('tags.db')) as index:
+            self.assertEqual(index.update([ tags_file ]), (len(SOURCE_TAGS), 0))
+
+            self.assertEqual([ (entry.file, entry.line) for entry in index.find('main') ], [ ('main.c', 10) ])
+            self.assertEqual([ entry.name for entry in index.find('treewalker', ignore_case = True) ], [ 'TreeWalker' ])
+
+            visit = index.members('TreeWalker')
+            self.assertEqual([ entry.name for entry in visit ], [ 'visit' ])
+            self.assertEqual((visit[0].kind, visit[0].scope, visit[0].access, visit[0].signature), ('p', ('class', 'TreeWalker'), 'public', '(Node *node)'))
+
+            self.assertEqual(index.members('Node', 'struct')[0].typeref, 'typename:Node *')
+            self.assertEqual([ entry.name for entry in index.search('walk') ], [ 'TreeWalker', 'case_walk', 'other_walk' ])
+
+    def test_directory_filter(self):
+        tags_file = self.write_tags(SOURCE_TAGS)
+
+        with TagsIndex(self.path('tags.db')) as index:
+            index.update([ tags_file ])
+
+            # no match for the `_` wildcard in `src/lib_x`, or for the different case in `src/Lib`
+            self.assertEqual([ entry.name for entry in index.symbols(directory = 'src/lib') ], [ 'Node', 'TreeWalker', 'next', 'visit' ])
+            self.assertEqual([ entry.name for entry in index.symbols(directory = 'src/lib', recursive = False) ], [ 'TreeWalker', 'visit' ])
+            self.assertEqual([ entry.name for entry in index.symbols(kind = 'p', directory = 'src') ], [ 'case_walk', 'other_walk', 'visit' ])
+            self.assertEqual([ entry.name for entry in index.symbols(directory = '.', recursive = False) ], [ 'main' ])
+
+    def test_re_update(self):
+        db_file     = self.path('tags.db')
+        source_tags = dict(SOURCE_TAGS)
+
+        with TagsIndex(db_file) as index:
+            self.assertEqual(index.update([ self.write_tags(source_tags) ]), (len(source_tags), 0))
+            self.assertEqual(index.update([ self.path('tags') ]), (0, 0))
+
+        source_tags['main.c'] = [ 'main\tmain.c\t/^int main(int argc, char **argv)$/;"\tf\tline:12' ]
+
+        with TagsIndex(db_file) as index:
+            self.assertEqual(index.update([ self.write_tags(source_tags) ]), (1, 0))
+            self.assertEqual([ entry.line for entry in index.find('main') ], [ 12 ])
+
+            # removed sources drop their tags, and the kinds and scopes no other tag uses
+            for source in [ 'src/lib/sub/node.h', 'src/lib_x/other.h', 'src/Lib/case.h' ]:
+                del source_tags[source]
+
+            self.assertEqual(index.update([ self.write_tags(source_tags) ]), (0, 3))
+            self.assertEqual(index.find('Node'), [ ])
+            self.assertEqual([ entry.name for entry in index.search('walk') ], [ 'TreeWalker' ])
+
+        connection = sqlite3.connect(db_file)
+
+        try:
+            self.assertEqual(sorted([ row[0] for row in connection.execute('SELECT name FROM kind') ]), [ 'c', 'f', 'p' ])
+            self.assertEqual([ row[0] for row in connection.execute('SELECT name FROM scope') ], [ 'TreeWalker' ])
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM tag').fetchone()[0], 3)
+        finally:
+            connection.close()
@@ -0,0 +1,81 @@
+import random
+
+from sconstest import TempDirTestCase
+
+from tags_reader import TagsReader
+
+""" tag names with mixed case and '_', which is ordered before the lower-case letters but after the upper-case ones """
+NAMES = \
+    [
+        'main', 'Main', 'MAIN', 'main_loop', 'mainframe', 'Main_Window', 'a_b', 'ab', 'aZ', 'A_C', 'Abc', 'abd',
+        '_start', '__init', 'zeta', 'Zulu', 'x_', 'X', 'xa', 'x_y'
+    ] \
+        + \
+    [ prefix + '%03d' % index for prefix in [ 'fn_', 'Fn', 'var' ] for index in range(150) ]
+
+""" sort key for each value of the !_TAG_FILE_SORTED pseudo-tag """
+SORT_KEYS = { 0: None, 1: lambda name: name, 2: lambda name: name.upper() }
+
+def tag_line(name, index):
+    return name + '\tsrc/file' + str(index % 7) + '.c\t' + str(index + 1) + ';"\tf\tline:' + str(index + 1)
+
+class TagsReaderTest(TempDirTestCase):
+    def write_tags(self, sorted_value):
+        lines = [ (name, tag_line(name, index)) for index, name in enumerate(NAMES) ]
+
+        # a name with more than one tag
+        lines.append(('main', tag_line('main', len(NAMES))))
+
+        if SORT_KEYS[sorted_value] is None:
+            random.Random(sorted_value).shuffle(lines)
+        else:
+            lines.sort(key = lambda line: (SORT_KEYS[sorted_value](line[0]), line[1]))
+
+        return \
+            self.write\
+                (
+                    'tags.' + str(sorted_value),
+                    '!_TAG_FILE_FORMAT\t2\t/extended format/\n'
+                    '!_TAG_FILE_SORTED\t' + str(sorted_value) + '\t/0=unsorted, 1=sorted, 2=foldcase/\n'
+                        +
+                    ''.join([ line + '\n' for name, line in lines ])
+                )
+
+    def check_lookups(self, sorted_value):
+        all_names = NAMES + [ 'main' ]
+
+        with TagsReader(self.write_tags(sorted_value)) as tags:
+            self.assertEqual(tags.sorted, sorted_value)
+
+            for key in NAMES + [ 'x', 'ma', 'MAI', 'a_', 'Fn1', 'missing', 'zz', '_', '' ]:
+                found = sorted([ entry.name for entry in tags.find(key) ])
+                self.assertEqual(found, sorted([ name for name in all_names if name == key ]), key)
+
+                found = sorted([ entry.name for entry in tags.find(key, ignore_case = True) ])
+                self.assertEqual(found, sorted([ name for name in all_names if name.lower() == key.lower() ]), key)
+
+                found = sorted([ entry.name for entry in tags.find_prefix(key) ])
+                self.assertEqual(found, sorted([ name for name in all_names if name.startswith(key) ]), key)
+
+                found = sorted([ entry.name for entry in tags.find_prefix(key, ignore_case = True) ])
+                self.assertEqual(found, sorted([ name for name in all_names if name.lower().startswith(key.lower()) ]), key)
+
+    def test_unsorted(self):
+        self.check_lookups(0)
+
+    def test_sorted(self):
+        self.check_lookups(1)
+
+    def test_sorted_foldcase(self):
+        self.check_lookups(2)
+
+    def test_entry_fields(self):
+        with TagsReader(self.write_tags(1)) as tags:
+            entries = tags.find('main')
+
+            self.assertEqual([ (entry.file, entry.line, entry.kind) for entry in entries ], [ ('src/file0.c', 1, 'f'), ('src/file' + str(len(NAMES) % 7) + '.c', len(NAMES) + 1, 'f') ])
+            self.assertEqual(len(list(tags.entries())), len(NAMES) + 1)
+
+    def test_empty_file(self):
+        with TagsReader(self.write('tags', '')) as tags:
+            self.assertEqual(tags.find('main'), [ ])